@@ -0,0 +1,109 @@
+# imports
+import numpy as np
+import pandas as pd
+import corpus
+import profiling
+from preprocess import MONTHS, DAYS, PERIODS
+
+# Key of the cube in DataFrame.attrs
+ATTR = 'cube'
+
+
+# Message counts per (user, sentiment value, day, hour), and chat when several chats are
+# analyzed together, the only thing the timeline and activity functions need. Its size
+# depends on the chat's length in days, not on the number of messages.
+class Cube:
+
+    def __init__(self, counts, size, has_value):
+        # Number of messages counted and whether they were scored
+        self.size = size
+        self.has_value = has_value
+
+        cube = counts.copy()
+        cube['count'] = cube['count'].astype(np.int32)
+
+        # Calendar fields, derived once per cube row instead of once per message
+        cube['only_date'] = cube['day'].dt.date
+        cube['year'] = cube['day'].dt.year
+        cube['month_num'] = cube['day'].dt.month
+        cube['month'] = pd.Categorical.from_codes(cube['month_num'] - 1, categories=MONTHS)
+        cube['day_name'] = pd.Categorical.from_codes(cube['day'].dt.dayofweek, categories=DAYS)
+        cube['period'] = pd.Categorical.from_codes(cube['hour'], categories=PERIODS)
+        self.cube = cube
+
+    # The cube is never modified, so copies of a data frame can share it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    # A filtered copy carries the cube of the frame it came from, it is only reused while
+    # the rows are the same (message ids are unique, so the same count means the same rows)
+    def matches(self, df):
+        return corpus.ID_COLUMN in df and self.size == df.shape[0] and self.has_value == ('value' in df)
+
+    # Rows of the cube for a user ('Overall' for everybody), sentiment value k
+    # and chat ('Overall' for all of them)
+    def select(self, user_selected='Overall', k=None, chat_selected='Overall'):
+        cube = self.cube
+        if user_selected != 'Overall':
+            cube = cube[cube['user'] == user_selected]
+        if chat_selected != 'Overall':
+            cube = cube[cube[CHAT] == chat_selected]
+        if k is not None:
+            cube = cube[cube['value'] == k]
+        return cube
+
+
+# Key columns of the cube
+KEYS = ['user', 'value', 'day', 'hour']
+
+# Column of the chat of every message, in frames of several chats
+CHAT = 'chat'
+
+
+# Key columns of a cube (or data frame)
+def keys_of(frame):
+    return KEYS + [CHAT] if CHAT in frame else KEYS
+
+
+# Count the messages of a data frame into a cube
+@profiling.profiled()
+def build(df):
+    keys = {
+        'user': df['user'],
+        'value': df['value'] if 'value' in df else pd.Series(0, index=df.index, dtype=np.int8),
+        'day': df['date'].dt.normalize(),
+        'hour': df['date'].dt.hour.astype(np.int8),
+    }
+    if CHAT in df:
+        keys[CHAT] = df[CHAT]
+    counts = pd.DataFrame(keys).groupby(keys_of(df), observed=True, sort=False).size()
+    return Cube(counts.rename('count').reset_index(), df.shape[0], 'value' in df)
+
+
+# Cube of two data frames put one after the other, from their own cubes
+def merge(first, second):
+    keys = keys_of(first.cube)
+    counts = pd.concat([first.cube[keys + ['count']], second.cube[keys + ['count']]])
+    counts = counts.groupby(keys, observed=True, sort=False)['count'].sum().reset_index()
+    return Cube(counts, first.size + second.size, first.has_value and second.has_value)
+
+
+# Cube of several chats put one after the other, from the cubes of the single chats:
+# their counts are only labelled with the chat, never counted again
+def combine(cubes, chats):
+    counts = pd.concat([cube.cube[KEYS + ['count']] for cube in cubes], ignore_index=True)
+    codes = np.repeat(np.arange(len(chats)), [len(cube.cube) for cube in cubes])
+    counts[CHAT] = pd.Categorical.from_codes(codes, categories=chats)
+    return Cube(counts, sum(cube.size for cube in cubes), all(cube.has_value for cube in cubes))
+
+
+# Cube of a data frame, built on first use and kept with the frame
+def lookup(df):
+    cube = df.attrs.get(ATTR)
+    if cube is None or not cube.matches(df):
+        cube = build(df)
+        df.attrs[ATTR] = cube
+    return cube
@@ -1,471 +1,523 @@
 # Importing modules
-import nltk
+# matplotlib, seaborn, wordcloud and nltk are imported when first needed, not on start up
 import streamlit as st
-import re
-import preprocess,helper
+import cache,pipeline,helper,jobs,profiling,responses,search
 import pandas as pd
-import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 st.sidebar.title("Whatsapp Chat and Sentiment Analysis")
 
-# VADER : is a lexicon and rule-based sentiment analysis tool that is specifically attuned to sentiments.
-nltk.download('vader_lexicon')
+# Sentiment value, label and colour of the three sentiment columns
+SENTIMENTS = [(1, 'Positive', 'green'), (0, 'Neutral', 'grey'), (-1, 'Negative', 'red')]
 
-uploaded_file = st.sidebar.file_uploader("Choose a file")
-if uploaded_file is not None:
-    # To read file as bytes:
 
-    # Main heading
-    st.markdown("<h1 style='text-align: center; color: black;'>Whatsapp Chat Analyzer</h1>",
-                unsafe_allow_html=True)
-
-    # file received is a stream of byte data which needs to be converted into string
-    bytes_data = uploaded_file.getvalue()
-    data = bytes_data.decode("utf-8")
-
-    # Perform preprocessing
-    df = preprocess.preprocessor(data)
-
-    # Importing SentimentIntensityAnalyzer class from "nltk.sentiment.vader"
-    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+# Result of compute for the uploaded chats and selected chat, remembered across reruns.
+# Results of the parsed messages, before sentiment is scored, are kept apart.
+def memo(key, compute):
+    return cache.results.get_or_compute((chat_key, chat_selected, scored) + key, compute)
 
-    # Object
-    sentiments = SentimentIntensityAnalyzer()
 
-    # Creating different columns for (Positive/Negative/Neutral)
-    df["po"] = [sentiments.polarity_scores(i)["pos"] for i in df["message"]]  # Positive
-    df["ne"] = [sentiments.polarity_scores(i)["neg"] for i in df["message"]]  # Negative
-    df["nu"] = [sentiments.polarity_scores(i)["neu"] for i in df["message"]]  # Neutral
+def heading(text):
+    st.markdown("<h3 style='text-align: center; color: black;'>" + text + "</h3>", unsafe_allow_html=True)
 
 
-    # To indentify true sentiment per row in message column
-    def sentiment(data):
-        if data["po"] >= data["ne"] and data["po"] >= data["nu"]:
-            return 1
-        if data["ne"] >= data["po"] and data["ne"] >= data["nu"]:
-            return -1
-        if data["nu"] >= data["po"] and data["nu"] >= data["ne"]:
-            return 0
+def figure():
+    import matplotlib.pyplot as plt
+    return plt.subplots()
 
-    # Creating new column & Applying function
-    df['value'] = df.apply(lambda row: sentiment(row), axis=1)
 
-    # fetch unique users
-    user_list = df['user'].unique().tolist()
-
-    # removing group notification from user_list, sort it and add value overall to it
-    user_list.sort()
-    user_list.insert(0, 'Overall')        # 0 is index of overall -- means group level analysis
+# Figures are closed once drawn, so reruns do not pile them up in memory
+def show(fig):
+    import matplotlib.pyplot as plt
+    st.pyplot(fig)
+    plt.close(fig)
 
-    user_selected = st.sidebar.selectbox("Show Analysis wrt", user_list)
 
-    if st.sidebar.button("Show Analysis"):        # show analysis button is clicked
+def bar_chart(x, y, color=None):
+    fig, ax = figure()
+    ax.bar(x, y, color=color)
+    ax.tick_params(axis='x', labelrotation=90)
+    show(fig)
 
-        # create 4 columns
-        num_msgs, words, num_links, num_media = helper.fetch_stats(user_selected, df)
-        col1, col2, col3, col4 = st.columns(4)
 
-        with col1:
-            st.header("Total Messages")
-            st.title(num_msgs)
+def barh_chart(x, y, color=None):
+    fig, ax = figure()
+    ax.barh(x, y, color=color)
+    ax.tick_params(axis='x', labelrotation=90)
+    show(fig)
 
-        with col2:
-            st.header("Total Words")
-            st.title(words)
-
-        with col3:
-            st.header("Media Shared")
-            st.title(num_media)
-
-        with col4:
-            st.header("Links Shared")
-            st.title(num_links)
-
-        # Monthly analysis of chats on a particular year
-        st.title("Monthly Timeline")
-        timeline = helper.monthly_timeline(user_selected, df)
-        fig, ax = plt.subplots()
-        ax.plot(timeline['time'], timeline['message'], color='green')
-        plt.xticks(rotation='vertical')
-        st.pyplot(fig)
-
-        #Daily Timeline
-        st.title("Daily Timeline")
-        daily_timeline = helper.daily_timeline(user_selected, df)
-        fig, ax = plt.subplots()
-        ax.plot(daily_timeline['only_date'], daily_timeline['message'], color='red')
-        plt.xticks(rotation='vertical')
-        st.pyplot(fig)
-
-        # Most active users based on day and month -- activity map
-        st.title("Activity Map")
-        col1, col2 = st.columns(2)
 
-        with col1:
-            st.header("Most Busy Day")
-            busy_day = helper.week_activity_map(user_selected, df)
-            fig, ax = plt.subplots()
-            ax.bar(busy_day.index, busy_day.values)
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
+def line_chart(x, y, color):
+    fig, ax = figure()
+    ax.plot(x, y, color=color)
+    ax.tick_params(axis='x', labelrotation=90)
+    show(fig)
 
-        with col2:
-            st.header("Most Busy Month")
-            busy_month = helper.month_activity_map(user_selected, df)
-            fig, ax = plt.subplots()
-            ax.bar(busy_month.index, busy_month.values, color='orange')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-
-        # Activity Heatmap
-        st.title("Weekly Activity Map")
-        user_heatmap = helper.activity_heatmap(user_selected, df)
-        fig, ax = plt.subplots()
-        ax = sns.heatmap(user_heatmap)
-        st.pyplot(fig)
-
-        # finding the busiest users in the group(only for grp level)
-        if user_selected == 'Overall':
-            st.title("Most Active Users")
-            x, new_df = helper.most_active_user(df)
-            fig, ax = plt.subplots()
-
-            col1, col2 = st.columns(2)
-
-            with col1:
-                ax.bar(x.index, x.values, color = 'red')
-                plt.xticks(rotation = 'vertical')
-                st.pyplot(fig)
-
-            with col2:
-                st.dataframe(new_df)
-
-        # wordCloud
-        st.title("Word Cloud")
-        df_wc = helper.create_wordcloud(user_selected, df)
-        fig, ax = plt.subplots()
-        ax.imshow(df_wc)
-        st.pyplot(fig)
-
-        # Most common meaning full words
-        most_common_df = helper.most_common_used_words(user_selected, df)
-        fig, ax = plt.subplots()
-        ax.barh(most_common_df[0], most_common_df[1])
-        plt.xticks(rotation='vertical')
-        st.title("Most Common words")
-        st.pyplot(fig)
-
-        # Emoji analysis top 10
-        emoji_df = helper.emoji_helper(user_selected, df)
-        st.title("Emoji Analysis")
 
-        col1, col2 = st.columns(2)
-        with col1:
-            st.dataframe(emoji_df)
-        with col2:
-            fig, ax = plt.subplots()
-            ax.pie(emoji_df[1].head(10), labels=emoji_df[0].head(10), autopct="%0.2f")
-            st.pyplot(fig)
+# One line per column of data
+def lines_chart(data):
+    fig, ax = figure()
+    for column in data.columns:
+        ax.plot(data.index, data[column], label=column)
+    ax.legend()
+    ax.tick_params(axis='x', labelrotation=90)
+    show(fig)
 
-        # Main heading
-        st.markdown("<h1 style='text-align: center; color: black;'>Whatsapp Sentiment Analyzer</h1>",
-                    unsafe_allow_html=True)
 
-        # Monthly activity map
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.markdown("<h3 style='text-align: center; color: black;'>Monthly Activity map(Positive)</h3>",
-                        unsafe_allow_html=True)
+def heatmap_chart(data):
+    import seaborn as sns
+    fig, ax = figure()
+    ax = sns.heatmap(data, ax=ax)
+    show(fig)
 
-            busy_month = helper.month_activity_map_sentiment(user_selected, df, 1)
 
-            fig, ax = plt.subplots()
-            ax.bar(busy_month.index, busy_month.values, color='green')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
+def image_chart(image):
+    fig, ax = figure()
+    ax.imshow(image)
+    show(fig)
 
-        with col2:
-            st.markdown("<h3 style='text-align: center; color: black;'>Monthly Activity map(Neutral)</h3>",
-                        unsafe_allow_html=True)
 
-            busy_month = helper.month_activity_map_sentiment(user_selected, df, 0)
+# Word frequencies of the selected user (and sentiment k), shared by word clouds and most common words
+def frequencies(user_selected, df, k=None):
+    return memo(('word_frequencies', user_selected, k),
+                lambda: helper.word_frequencies(user_selected, df, k, chat_selected))
 
-            fig, ax = plt.subplots()
-            ax.bar(busy_month.index, busy_month.values, color='grey')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-        with col3:
-            st.markdown("<h3 style='text-align: center; color: black;'>Monthly Activity map(Negative)</h3>",
-                        unsafe_allow_html=True)
 
-            busy_month = helper.month_activity_map_sentiment(user_selected, df, -1)
+# Word cloud image, rendered once per chat, user, sentiment and size
+def wordcloud_chart(user_selected, df, k=None, width=500, height=500):
+    words = memo(('cloud_words', user_selected, k),
+                 lambda: helper.cloud_words(frequencies(user_selected, df, k)))
+    if words.empty:
+        st.info("No words to show.")
+        return
+    image_chart(memo(('wordcloud', user_selected, k, width, height),
+                     lambda: helper.wordcloud_from_frequencies(words, width, height).to_array()))
 
-            fig, ax = plt.subplots()
-            ax.bar(busy_month.index, busy_month.values, color='red')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
 
-        # Daily activity map
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.markdown("<h3 style='text-align: center; color: black;'>Daily Activity map(Positive)</h3>",
-                        unsafe_allow_html=True)
+def overview_section(user_selected, df):
 
-            busy_day = helper.week_activity_map_sentiment(user_selected, df, 1)
+    # create 4 columns
+    num_msgs, words, num_links, num_media = memo(('fetch_stats', user_selected),
+                                                 lambda: helper.fetch_stats(user_selected, df, chat_selected))
+    col1, col2, col3, col4 = st.columns(4)
 
-            fig, ax = plt.subplots()
-            ax.bar(busy_day.index, busy_day.values, color='green')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-        with col2:
-            st.markdown("<h3 style='text-align: center; color: black;'>Daily Activity map(Neutral)</h3>",
-                        unsafe_allow_html=True)
+    with col1:
+        st.header("Total Messages")
+        st.title(num_msgs)
 
-            busy_day = helper.week_activity_map_sentiment(user_selected, df, 0)
+    with col2:
+        st.header("Total Words")
+        st.title(words)
 
-            fig, ax = plt.subplots()
-            ax.bar(busy_day.index, busy_day.values, color='grey')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-        with col3:
-            st.markdown("<h3 style='text-align: center; color: black;'>Daily Activity map(Negative)</h3>",
-                        unsafe_allow_html=True)
+    with col3:
+        st.header("Media Shared")
+        st.title(num_media)
 
-            busy_day = helper.week_activity_map_sentiment(user_selected, df, -1)
+    with col4:
+        st.header("Links Shared")
+        st.title(num_links)
 
-            fig, ax = plt.subplots()
-            ax.bar(busy_day.index, busy_day.values, color='red')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
+    # Links shared per domain
+    domains_df = memo(('link_domains', user_selected),
+                      lambda: helper.link_domains(user_selected, df, chat_selected))
+    if domains_df.shape[0]:
+        st.title("Links Shared by Domain")
+        st.dataframe(domains_df.head(20))
 
-        # Weekly activity map
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.markdown("<h3 style='text-align: center; color: black;'>Weekly Activity Map(Positive)</h3>",
-                        unsafe_allow_html=True)
+    # Monthly analysis of chats on a particular year
+    st.title("Monthly Timeline")
+    timeline = memo(('monthly_timeline', user_selected),
+                    lambda: helper.monthly_timeline(user_selected, df, chat_selected))
+    line_chart(timeline['time'], timeline['message'], 'green')
 
-            user_heatmap = helper.activity_heatmap_sentiment(user_selected, df, 1)
+    #Daily Timeline
+    st.title("Daily Timeline")
+    daily_timeline = memo(('daily_timeline', user_selected),
+                          lambda: helper.daily_timeline(user_selected, df, chat_selected))
+    line_chart(daily_timeline['only_date'], daily_timeline['message'], 'red')
 
-            fig, ax = plt.subplots()
-            ax = sns.heatmap(user_heatmap)
-            st.pyplot(fig)
 
-        with col2:
-            st.markdown("<h3 style='text-align: center; color: black;'>Weekly Activity Map(Neutral)</h3>",
-                        unsafe_allow_html=True)
+def activity_section(user_selected, df):
 
-            user_heatmap = helper.activity_heatmap_sentiment(user_selected, df, 0)
+    # Most active users based on day and month -- activity map
+    st.title("Activity Map")
+    col1, col2 = st.columns(2)
 
-            fig, ax = plt.subplots()
-            ax = sns.heatmap(user_heatmap)
-            st.pyplot(fig)
-        with col3:
-            st.markdown("<h3 style='text-align: center; color: black;'>Weekly Activity Map(Negative)</h3>",
-                        unsafe_allow_html=True)
+    with col1:
+        st.header("Most Busy Day")
+        busy_day = memo(('week_activity_map', user_selected),
+                        lambda: helper.week_activity_map(user_selected, df, chat_selected))
+        bar_chart(busy_day.index, busy_day.values)
+
+    with col2:
+        st.header("Most Busy Month")
+        busy_month = memo(('month_activity_map', user_selected),
+                          lambda: helper.month_activity_map(user_selected, df, chat_selected))
+        bar_chart(busy_month.index, busy_month.values, 'orange')
+
+    # Activity Heatmap
+    st.title("Weekly Activity Map")
+    heatmap_chart(memo(('activity_heatmap', user_selected),
+                       lambda: helper.activity_heatmap(user_selected, df, chat_selected)))
 
-            user_heatmap = helper.activity_heatmap_sentiment(user_selected, df, -1)
+    # finding the busiest users in the group(only for grp level)
+    if user_selected == 'Overall':
+        st.title("Most Active Users")
+        x, new_df = memo(('most_active_user',), lambda: helper.most_active_user(df, chat_selected))
 
-            fig, ax = plt.subplots()
-            ax = sns.heatmap(user_heatmap)
-            st.pyplot(fig)
+        col1, col2 = st.columns(2)
 
-        # Daily timeline
-        col1, col2, col3 = st.columns(3)
         with col1:
-            st.markdown("<h3 style='text-align: center; color: black;'>Daily Timeline(Positive)</h3>",
-                        unsafe_allow_html=True)
-
-            daily_timeline = helper.daily_timeline_sentiment(user_selected, df, 1)
+            bar_chart(x.index, x.values, 'red')
 
-            fig, ax = plt.subplots()
-            ax.plot(daily_timeline['only_date'], daily_timeline['message'], color='green')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
         with col2:
-            st.markdown("<h3 style='text-align: center; color: black;'>Daily Timeline(Neutral)</h3>",
-                        unsafe_allow_html=True)
+            st.dataframe(new_df)
 
-            daily_timeline = helper.daily_timeline_sentiment(user_selected, df, 0)
 
-            fig, ax = plt.subplots()
-            ax.plot(daily_timeline['only_date'], daily_timeline['message'], color='grey')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-        with col3:
-            st.markdown("<h3 style='text-align: center; color: black;'>Daily Timeline(Negative)</h3>",
-                        unsafe_allow_html=True)
+def words_section(user_selected, df):
+
+    # wordCloud
+    st.title("Word Cloud")
+    wordcloud_chart(user_selected, df)
+
+    # Most common meaning full words
+    most_common_df = helper.frequency_frame(frequencies(user_selected, df).head(20))
+    st.title("Most Common words")
+    barh_chart(most_common_df[0], most_common_df[1])
+
+    # Emoji analysis top 10
+    emoji_df = memo(('emoji_helper', user_selected),
+                    lambda: helper.emoji_helper(user_selected, df, chat_selected))
+    st.title("Emoji Analysis")
 
-            daily_timeline = helper.daily_timeline_sentiment(user_selected, df, -1)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.dataframe(emoji_df)
+    with col2:
+        fig, ax = figure()
+        ax.pie(emoji_df[1].head(10), labels=emoji_df[0].head(10), autopct="%0.2f")
+        show(fig)
+
+
+# One chart per sentiment side by side, compute(k) returns the data of sentiment k
+def sentiment_columns(title, name, user_selected, compute, draw):
+    for col, (k, label, color) in zip(st.columns(3), SENTIMENTS):
+        with col:
+            heading(title + "(" + label + ")")
+            draw(memo((name, user_selected, k), lambda: compute(k)), color)
+
+
+def sentiment_timelines_section(user_selected, df):
+
+    # Monthly activity map
+    sentiment_columns("Monthly Activity map", 'month_activity_map_sentiment', user_selected,
+                      lambda k: helper.month_activity_map_sentiment(user_selected, df, k, chat_selected),
+                      lambda busy_month, color: bar_chart(busy_month.index, busy_month.values, color))
+
+    # Daily activity map
+    sentiment_columns("Daily Activity map", 'week_activity_map_sentiment', user_selected,
+                      lambda k: helper.week_activity_map_sentiment(user_selected, df, k, chat_selected),
+                      lambda busy_day, color: bar_chart(busy_day.index, busy_day.values, color))
+
+    # Weekly activity map
+    sentiment_columns("Weekly Activity Map", 'activity_heatmap_sentiment', user_selected,
+                      lambda k: helper.activity_heatmap_sentiment(user_selected, df, k, chat_selected),
+                      lambda user_heatmap, color: heatmap_chart(user_heatmap))
+
+    # Daily timeline
+    sentiment_columns("Daily Timeline", 'daily_timeline_sentiment', user_selected,
+                      lambda k: helper.daily_timeline_sentiment(user_selected, df, k, chat_selected),
+                      lambda timeline, color: line_chart(timeline['only_date'], timeline['message'], color))
+
+    # Monthly timeline
+    sentiment_columns("Monthly Timeline", 'monthly_timeline_sentiment', user_selected,
+                      lambda k: helper.monthly_timeline_sentiment(user_selected, df, k, chat_selected),
+                      lambda timeline, color: line_chart(timeline['time'], timeline['message'], color))
+
+
+def sentiment_users_section(user_selected, df):
+    if user_selected != 'Overall':
+        st.info("Contribution per user is shown for the Overall analysis.")
+        return
+
+    # Percentage contributed
+    for col, (k, label, color) in zip(st.columns(3), SENTIMENTS):
+        with col:
+            heading("Most " + label + " Contribution")
+            st.dataframe(memo(('percentage_sentiment', k),
+                              lambda: helper.percentage_sentiment(df, k, chat_selected)))
+
+    # Most Positive,Negative,Neutral User...
+    rows = helper.select_rows(df, 'Overall', chat_selected)
+    for col, (k, label, color) in zip(st.columns(3), SENTIMENTS):
+        with col:
+            heading("Most " + label + " Users")
+            x = memo(('sentiment_users', k),
+                     lambda: helper.user_counts(rows['user'][rows['value'] == k]).head(10))
+            bar_chart(x.index, x.values, color)
+
+
+def sentiment_words_section(user_selected, df):
+
+    # WORDCLOUD......
+    for col, (k, label, color) in zip(st.columns(3), SENTIMENTS):
+        with col:
+            heading(label + " WordCloud")
+            wordcloud_chart(user_selected, df, k)
+
+    # Most common positive words
+    for col, (k, label, color) in zip(st.columns(3), SENTIMENTS):
+        with col:
+            most_common_df = helper.frequency_frame(frequencies(user_selected, df, k).head(20))
+            heading(label + " Words")
+            barh_chart(most_common_df[0], most_common_df[1], color)
+
+
+def chats_section(user_selected, df):
+    if 'chat' not in df:
+        st.info("Upload several chats to compare them.")
+        return
+
+    # Statistics of every chat, for one person across groups or for the groups themselves
+    st.title("Chats")
+    stats = memo(('chat_stats', user_selected), lambda: helper.chat_stats(user_selected, df))
+    st.dataframe(stats)
+    bar_chart(stats['chat'], stats['messages'])
+
+    # Monthly timeline of every chat
+    st.title("Monthly Timeline per Chat")
+    lines_chart(memo(('chat_timeline', user_selected), lambda: helper.chat_timeline(user_selected, df)))
+
+
+def responses_section(user_selected, df):
+    gap = st.slider("Minutes of silence that end a conversation", 5, 24 * 60, responses.SESSION_GAP,
+                    step=5)
+
+    # Reply times
+    st.title("Reply Time")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.header("Median Minutes per User")
+        latency = memo(('user_latency', user_selected, gap),
+                       lambda: responses.user_latency(user_selected, df, gap, chat_selected))
+        bar_chart(latency['user'].astype(str), latency['median_minutes'], 'purple')
+    with col2:
+        st.header("Per User Pair")
+        st.dataframe(memo(('pair_latency', user_selected, gap),
+                          lambda: responses.pair_latency(user_selected, df, gap, chat_selected)))
+
+    # Who replies to whom
+    st.title("Who Replies to Whom")
+    matrix = memo(('reply_matrix', user_selected, gap),
+                  lambda: responses.reply_matrix(user_selected, df, gap, chat_selected))
+    if matrix.size:
+        heatmap_chart(matrix)
+    else:
+        st.info("No replies to show.")
+
+    # Conversation sessions
+    st.title("Conversations")
+    summary, starters = memo(('session_summary', user_selected, gap),
+                             lambda: responses.session_summary(user_selected, df, gap, chat_selected))
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.header("Conversations")
+        st.title(summary['sessions'])
+    with col2:
+        st.header("Median Minutes")
+        st.title(summary['median_minutes'])
+    with col3:
+        st.header("Median Messages")
+        st.title(summary['median_messages'])
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.header("Conversation Starters")
+        bar_chart(starters.index, starters.values, 'teal')
+    with col2:
+        st.header("Longest Conversations")
+        found = memo(('sessions', user_selected, gap),
+                     lambda: responses.sessions(user_selected, df, gap, chat_selected))
+        st.dataframe(found.sort_values('messages', ascending=False, kind='stable').head(20))
+
+
+def search_section(user_selected, df):
+    st.title("Search")
+    query = st.text_input("Words, \"phrases\" and prefix* of the messages to find")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        labels = ['Any'] + [label for _, label, _ in SENTIMENTS]
+        label = st.selectbox("Sentiment", labels)
+        k = None if label == 'Any' else SENTIMENTS[labels.index(label) - 1][0]
+    with col2:
+        first, last = df['date'].min(), df['date'].max()
+        dates = st.date_input("Dates", value=(first.date(), last.date()), min_value=first.date(),
+                              max_value=last.date()) if df.shape[0] else ()
+
+    start = dates[0] if len(dates) > 0 else None
+    end = dates[1] if len(dates) > 1 else None
+
+    # The index is built on the first search, later searches take milliseconds
+    found = search.find(df, query, user_selected, k, start, end, chat_selected)
+    st.caption(str(found.shape[0]) + " messages")
+    st.dataframe(found.head(1000))
+
+
+# Sections of the dashboard, only the open one is computed and drawn.
+# The cheap overview comes first, word clouds last.
+SECTIONS = {
+    "Overview": overview_section,
+    "Activity": activity_section,
+    "Words & Emoji": words_section,
+    "Sentiment Timelines": sentiment_timelines_section,
+    "Sentiment Users": sentiment_users_section,
+    "Sentiment Words": sentiment_words_section,
+    "Responses": responses_section,
+    "Chats": chats_section,
+    "Search": search_section,
+}
+
+# Sections which only need the parsed messages, shown while sentiment is being scored
+PARTIAL_SECTIONS = ["Overview", "Activity"]
+
+# Labels of the stages of loading chats, see pipeline.load_stored and pipeline.load_chats
+STAGES = {
+    'store': "Reading saved results",
+    'extend': "Looking for an earlier export",
+    'parse': "Parsing messages",
+    'sentiment': "Scoring sentiment",
+    'aggregate': "Counting messages",
+    'save': "Saving results",
+    'chats': "Analyzing chats",
+    'combine': "Combining chats",
+}
+
+# Seconds between two looks at a running job
+POLL_SECONDS = 1
+
+
+# Stage and progress of a running job, looked at again every POLL_SECONDS. The whole page is
+# drawn again once the parsed messages or the analyzed chats are there.
+@st.fragment(run_every=POLL_SECONDS)
+def progress_panel(had_partial):
+    job = jobs.running(st.session_state['chat_key'])
+    if job is None:
+        st.rerun()
+    snapshot = job.progress.snapshot()
+    if job.done() or (snapshot['partial'] is not None) != had_partial:
+        st.rerun()
+
+    label = STAGES.get(snapshot['stage'], "Starting")
+    if snapshot['total']:
+        st.progress(min(snapshot['done'] / snapshot['total'], 1.0),
+                    text="%s: %d of %d" % (label, snapshot['done'], snapshot['total']))
+    else:
+        st.progress(0.0, text="%s... %.0fs" % (label, snapshot['seconds']))
+    if snapshot['finished']:
+        st.caption(", ".join("%s %.1fs" % (STAGES.get(stage, stage), seconds)
+                             for stage, seconds in snapshot['finished']))
+    if had_partial:
+        st.caption("Stats and timelines of the parsed messages are shown, "
+                   "sentiment is still being scored.")
+
+
+uploaded_files = st.sidebar.file_uploader("Choose a file", accept_multiple_files=True)
+if uploaded_files:
+    # To read files as bytes:
+    files = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
 
-            fig, ax = plt.subplots()
-            ax.plot(daily_timeline['only_date'], daily_timeline['message'], color='red')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-
-        # Monthly timeline
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.markdown("<h3 style='text-align: center; color: black;'>Monthly Timeline(Positive)</h3>",
-                        unsafe_allow_html=True)
-
-            timeline = helper.monthly_timeline_sentiment(user_selected, df, 1)
+    # Main heading
+    st.markdown("<h1 style='text-align: center; color: black;'>Whatsapp Chat Analyzer</h1>",
+                unsafe_allow_html=True)
 
-            fig, ax = plt.subplots()
-            ax.plot(timeline['time'], timeline['message'], color='green')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-        with col2:
-            st.markdown("<h3 style='text-align: center; color: black;'>Monthly Timeline(Neutral)</h3>",
-                        unsafe_allow_html=True)
-
-            timeline = helper.monthly_timeline_sentiment(user_selected, df, 0)
-
-            fig, ax = plt.subplots()
-            ax.plot(timeline['time'], timeline['message'], color='grey')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-        with col3:
-            st.markdown("<h3 style='text-align: center; color: black;'>Monthly Timeline(Negative)</h3>",
-                        unsafe_allow_html=True)
-
-            timeline = helper.monthly_timeline_sentiment(user_selected, df, -1)
-
-            fig, ax = plt.subplots()
-            ax.plot(timeline['time'], timeline['message'], color='red')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-
-        # Percentage contributed
-        if user_selected == 'Overall':
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.markdown("<h3 style='text-align: center; color: black;'>Most Positive Contribution</h3>",
-                            unsafe_allow_html=True)
-                x = helper.percentage_sentiment(df, 1)
-
-                # Displaying
-                st.dataframe(x)
-            with col2:
-                st.markdown("<h3 style='text-align: center; color: black;'>Most Neutral Contribution</h3>",
-                            unsafe_allow_html=True)
-                y = helper.percentage_sentiment(df, 0)
-
-                # Displaying
-                st.dataframe(y)
-            with col3:
-                st.markdown("<h3 style='text-align: center; color: black;'>Most Negative Contribution</h3>",
-                            unsafe_allow_html=True)
-                z = helper.percentage_sentiment(df, -1)
-
-                # Displaying
-                st.dataframe(z)
-
-        # Most Positive,Negative,Neutral User...
-        if user_selected == 'Overall':
-            # Getting names per sentiment
-            x = df['user'][df['value'] == 1].value_counts().head(10)
-            y = df['user'][df['value'] == -1].value_counts().head(10)
-            z = df['user'][df['value'] == 0].value_counts().head(10)
-
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                # heading
-                st.markdown("<h3 style='text-align: center; color: black;'>Most Positive Users</h3>",
-                            unsafe_allow_html=True)
-
-                # Displaying
-                fig, ax = plt.subplots()
-                ax.bar(x.index, x.values, color='green')
-                plt.xticks(rotation='vertical')
-                st.pyplot(fig)
-            with col2:
-                # heading
-                st.markdown("<h3 style='text-align: center; color: black;'>Most Neutral Users</h3>",
-                            unsafe_allow_html=True)
-
-                # Displaying
-                fig, ax = plt.subplots()
-                ax.bar(z.index, z.values, color='grey')
-                plt.xticks(rotation='vertical')
-                st.pyplot(fig)
-            with col3:
-                # heading
-                st.markdown("<h3 style='text-align: center; color: black;'>Most Negative Users</h3>",
-                            unsafe_allow_html=True)
-
-                # Displaying
-                fig, ax = plt.subplots()
-                ax.bar(y.index, y.values, color='red')
-                plt.xticks(rotation='vertical')
-                st.pyplot(fig)
-
-        # WORDCLOUD......
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            # heading
-            st.markdown("<h3 style='text-align: center; color: black;'>Positive WordCloud</h3>",
-                        unsafe_allow_html=True)
-
-            # Creating wordcloud of positive words
-            df_wc = helper.create_wordcloud_sentiment(user_selected, df, 1)
-            fig, ax = plt.subplots()
-            ax.imshow(df_wc)
-            st.pyplot(fig)
-        with col2:
-            # heading
-            st.markdown("<h3 style='text-align: center; color: black;'>Neutral WordCloud</h3>",
-                            unsafe_allow_html=True)
-
-            # Creating wordcloud of neutral words
-            df_wc = helper.create_wordcloud_sentiment(user_selected, df, 0)
-            fig, ax = plt.subplots()
-            ax.imshow(df_wc)
-            st.pyplot(fig)
-        with col3:
-            # heading
-            st.markdown("<h3 style='text-align: center; color: black;'>Negative WordCloud</h3>",
-                        unsafe_allow_html=True)
-
-            # Creating wordcloud of negative words
-            df_wc = helper.create_wordcloud_sentiment(user_selected, df, -1)
-            fig, ax = plt.subplots()
-            ax.imshow(df_wc)
-            st.pyplot(fig)
-
-        # Most common positive words
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            # Data frame of most common positive words.
-            most_common_df = helper.most_common_words_sentiment(user_selected, df, 1)
+    # Parsed and scored chats, reused across reruns while the same files are uploaded.
+    # Several chats are combined into one frame with a chat column.
+    # They are loaded in a background job, chats in memory or in the store are there at once.
+    # Content keys of the uploads, hashed once per uploaded file (the uploader gives every
+    # upload its own file_id)
+    known = st.session_state.get('content_keys', {})
+    keys = [known[upload.file_id] if upload.file_id in known else cache.content_key(data)
+            for upload, (_, data) in zip(uploaded_files, files)]
+    st.session_state['content_keys'] = {upload.file_id: key
+                                        for upload, key in zip(uploaded_files, keys)}
+
+    if len(files) == 1:
+        chat_key = keys[0]
+        analyze = lambda progress: pipeline.load(files[0][1], chat_key, progress)
+    else:
+        chat_key = tuple(keys)
+        analyze = lambda progress: pipeline.load_chats(files, progress=progress, keys=keys)
+
+    # Stages run for these chats, here and in the job, are tagged with their key, the
+    # profiling panel shows those of the chats open in this session
+    def load(progress):
+        with profiling.tagged(chat_key):
+            return analyze(progress)
+
+    # The session keeps only the key, frames leave memory with cache.results. Chats in memory
+    # or in the store are read right here; the others are analyzed by a job, which this run
+    # waits for a moment before showing its progress.
+    st.session_state['chat_key'] = chat_key
+    with profiling.tagged(chat_key), profiling.stage('app.load', len(files)):
+        job = jobs.running(chat_key)
+        if job is None and pipeline.ready(keys):
+            df = analyze(jobs.NO_PROGRESS)
+        elif job is None:
+            job = jobs.submit(chat_key, load)
+
+    if job is not None:
+        finished = job.wait(0.5)
+        if finished and job.future.exception() is not None:
+            # The next rerun tries again
+            st.error("The chat could not be analyzed: %s" % job.future.exception())
+            st.stop()
+
+        if finished:
+            df = job.result()
+        else:
+            # Until sentiment is scored, the parsed messages (once there) are analyzed
+            df = job.progress.snapshot()['partial']
+            progress_panel(df is not None)
+            if df is None:
+                st.stop()
+        del job
+    scored = 'value' in df
+
+    # Analysis of one chat or all of them
+    chat_selected = 'Overall'
+    if 'chat' in df:
+        chat_selected = st.sidebar.selectbox("Chat", ['Overall'] + df['chat'].cat.categories.tolist())
 
-            # heading
-            st.markdown("<h3 style='text-align: center; color: black;'>Positive Words</h3>", unsafe_allow_html=True)
-            fig, ax = plt.subplots()
-            ax.barh(most_common_df[0], most_common_df[1], color='green')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
+    # fetch unique users
+    chat_rows = helper.select_rows(df, 'Overall', chat_selected)
+    user_list = helper.user_counts(chat_rows['user']).index.tolist()
 
-        with col2:
-            # Data frame of most common neutral words.
-            most_common_df = helper.most_common_words_sentiment(user_selected, df, 0)
-
-            # heading
-            st.markdown("<h3 style='text-align: center; color: black;'>Neutral Words</h3>", unsafe_allow_html=True)
-            fig, ax = plt.subplots()
-            ax.barh(most_common_df[0], most_common_df[1], color='grey')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
-        with col3:
-            # Data frame of most common negative words.
-            most_common_df = helper.most_common_words_sentiment(user_selected, df, -1)
-
-            # heading
-            st.markdown("<h3 style='text-align: center; color: black;'>Negative Words</h3>", unsafe_allow_html=True)
-            fig, ax = plt.subplots()
-            ax.barh(most_common_df[0], most_common_df[1], color='red')
-            plt.xticks(rotation='vertical')
-            st.pyplot(fig)
+    # removing group notification from user_list, sort it and add value overall to it
+    user_list.sort()
+    user_list.insert(0, 'Overall')        # 0 is index of overall -- means group level analysis
 
+    user_selected = st.sidebar.selectbox("Show Analysis wrt", user_list)
 
+    # show analysis button is clicked, the analysis stays open while sections are switched
+    if st.sidebar.button("Show Analysis"):
+        st.session_state['show_analysis'] = True
+
+    if st.session_state.get('show_analysis'):
+        section = st.radio("Section", list(SECTIONS) if scored else PARTIAL_SECTIONS, horizontal=True,
+                           label_visibility='collapsed')
+        with profiling.tagged(chat_key), profiling.stage('app.render.' + section, df.shape[0]):
+            SECTIONS[section](user_selected, df)
+
+# Stage timings of the chats open in this session, when profiling is switched on with CHAT_PROFILE.
+# Other sessions showing the same chats add theirs too.
+if profiling.ENABLED and uploaded_files:
+    with st.sidebar.expander("Profiling"):
+        recorded = profiling.snapshot(chat_key)
+        if recorded:
+            stages = pd.DataFrame(recorded).drop(columns=['started', 'thread', 'tag'])
+            stages['stage'] = ['  ' * depth + name for depth, name in zip(stages['depth'], stages['stage'])]
+            st.dataframe(stages.drop(columns=['depth']).tail(200))
+            st.download_button("Download trace", profiling.trace_json(recorded), file_name='trace.json',
+                               mime='application/json')
+        if st.button("Clear timings"):
+            profiling.clear(chat_key)
@@ -0,0 +1,301 @@
+# Benchmarks of parsing, sentiment scoring and every helper function on synthetic chats.
+#
+#     python benchmark.py --sizes 10000,100000 --out bench.json
+#     python benchmark.py --sizes 10000,100000 --baseline bench.json --threshold 0.2
+#     python benchmark.py --imports --out imports.json
+#
+# The chats are generated from a fixed seed, so runs on the same machine are comparable.
+# With --baseline, every timing more than threshold slower than the baseline's is reported
+# and the exit status is 1; a baseline run with other chat, scoring or repeat settings is not
+# compared and the exit status is 2. --imports times the cold start of the app instead: the imports
+# of app.py and of every library loaded on first use, each in a fresh interpreter.
+
+# imports
+import argparse
+import ast
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Libraries the app imports when a feature first needs them
+LAZY_IMPORTS = ['matplotlib.pyplot', 'seaborn', 'wordcloud', 'nltk', 'urlextract', 'emoji']
+
+WORDS = ('hai kya ok haha good bad happy sad love hate meeting tomorrow today call me '
+         'please thanks yes no maybe party work late food home lol the a is it').split()
+EMOJIS = ['😂', '❤️', '👍', '👍🏽', '🙏', '🔥', '😭', '🇮🇳', '👨‍👩‍👧', '😍']
+DOMAINS = ['example.com', 'youtube.com', 'news.org', 'maps.google.com', 'github.io']
+
+
+# Text of a synthetic export in the format preprocess.preprocessor reads
+def generate_chat(messages, users=20, emoji_ratio=0.1, link_ratio=0.02, multiline_ratio=0.05,
+                  media_ratio=0.03, notification_ratio=0.005, seed=0):
+    rng = random.Random(seed)
+    names = ['User %d' % i for i in range(users)]
+    date = datetime(2020, 1, 1)
+    lines = []
+
+    for _ in range(messages):
+        date += timedelta(minutes=rng.randint(0, 30))
+        stamp = '%02d/%02d/%02d, %d:%02d\u202f%s - ' % (
+            date.day, date.month, date.year % 100, (date.hour % 12) or 12, date.minute,
+            'am' if date.hour < 12 else 'pm')
+
+        if rng.random() < notification_ratio:
+            lines.append(stamp + '%s added %s\n' % (rng.choice(names), rng.choice(names)))
+            continue
+
+        if rng.random() < media_ratio:
+            text = '<Media omitted>'
+        else:
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 15)))
+            if rng.random() < emoji_ratio:
+                text += ' ' + ''.join(rng.choice(EMOJIS) for _ in range(rng.randint(1, 3)))
+            if rng.random() < link_ratio:
+                text += ' https://%s/%d' % (rng.choice(DOMAINS), rng.randint(1, 9999))
+            if rng.random() < multiline_ratio:
+                text += '\n' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+
+        lines.append(stamp + rng.choice(names) + ': ' + text + '\n')
+
+    return ''.join(lines)
+
+
+# Best wall time of repeat runs of function
+def timed(function, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# Calls of every public helper function, for user_selected
+def helper_calls(df, user_selected):
+    import helper
+
+    calls = {
+        'fetch_stats': lambda: helper.fetch_stats(user_selected, df),
+        'link_domains': lambda: helper.link_domains(user_selected, df),
+        'most_active_user': lambda: helper.most_active_user(df),
+        'word_frequencies': lambda: helper.word_frequencies(user_selected, df),
+        'create_wordcloud': lambda: helper.create_wordcloud(user_selected, df),
+        'most_common_used_words': lambda: helper.most_common_used_words(user_selected, df),
+        'emoji_helper': lambda: helper.emoji_helper(user_selected, df),
+        'monthly_timeline': lambda: helper.monthly_timeline(user_selected, df),
+        'daily_timeline': lambda: helper.daily_timeline(user_selected, df),
+        'week_activity_map': lambda: helper.week_activity_map(user_selected, df),
+        'month_activity_map': lambda: helper.month_activity_map(user_selected, df),
+        'activity_heatmap': lambda: helper.activity_heatmap(user_selected, df),
+        'week_activity_map_sentiment': lambda: helper.week_activity_map_sentiment(user_selected, df, 1),
+        'month_activity_map_sentiment': lambda: helper.month_activity_map_sentiment(user_selected, df, 1),
+        'activity_heatmap_sentiment': lambda: helper.activity_heatmap_sentiment(user_selected, df, 1),
+        'daily_timeline_sentiment': lambda: helper.daily_timeline_sentiment(user_selected, df, 1),
+        'monthly_timeline_sentiment': lambda: helper.monthly_timeline_sentiment(user_selected, df, 1),
+        'percentage_sentiment': lambda: helper.percentage_sentiment(df, 1),
+        'create_wordcloud_sentiment': lambda: helper.create_wordcloud_sentiment(user_selected, df, 1),
+        'most_common_words_sentiment': lambda: helper.most_common_words_sentiment(user_selected, df, 1),
+    }
+    return calls
+
+
+# Calls of the helper functions of several chats combined into df, for user_selected and
+# the chat chat_selected
+def chat_calls(df, user_selected, chat_selected):
+    import helper
+
+    calls = {
+        'chat_stats': lambda: helper.chat_stats(user_selected, df),
+        'chat_timeline': lambda: helper.chat_timeline(user_selected, df),
+        'fetch_stats': lambda: helper.fetch_stats(user_selected, df, chat_selected),
+        'word_frequencies': lambda: helper.word_frequencies(user_selected, df, chat_selected=chat_selected),
+        'emoji_helper': lambda: helper.emoji_helper(user_selected, df, chat_selected),
+        'monthly_timeline': lambda: helper.monthly_timeline(user_selected, df, chat_selected),
+        'activity_heatmap': lambda: helper.activity_heatmap(user_selected, df, chat_selected),
+    }
+    return calls
+
+
+# Timings of one chat size (name -> seconds) and the memory of its data frame
+def run_size(size, args):
+    import aggregate
+    import corpus
+    import pipeline
+    import preprocess
+    import sentiment
+
+    text = generate_chat(size, users=args.users, emoji_ratio=args.emoji_ratio,
+                         link_ratio=args.link_ratio, multiline_ratio=args.multiline_ratio,
+                         seed=args.seed)
+    timings = {}
+
+    timings['preprocessor'], df = timed(lambda: preprocess.preprocessor(text), args.repeat)
+    # The words, emojis and links index, part of the preprocessor timing
+    timings['corpus_index'], _ = timed(lambda: corpus.CorpusIndex(df['message']), args.repeat)
+    # Without the on-disk score cache, repeated runs would only time cache hits
+    timings['sentiment'], df = timed(
+        lambda: sentiment.add_sentiment(df, workers=args.workers, score_cache=None,
+                                        backend=args.sentiment), args.repeat)
+    timings['aggregate'], _ = timed(lambda: aggregate.build(df), args.repeat)
+    aggregate.lookup(df)
+
+    user = df['user'].value_counts().index[0]
+    for user_selected, suffix in [('Overall', ''), (user, '[user]')]:
+        for name, call in helper_calls(df, user_selected).items():
+            timings[name + suffix], _ = timed(call, args.repeat)
+
+    # Two uploads of the chat side by side, what the app shows for several files
+    names = ['chat 1', 'chat 2']
+    timings['combine'], chats = timed(lambda: pipeline.combine(names, [df, df]), args.repeat)
+    for user_selected, suffix in [('Overall', ''), (user, '[user]')]:
+        for name, call in chat_calls(chats, user_selected, names[1]).items():
+            timings[name + '[chats]' + suffix], _ = timed(call, args.repeat)
+
+    total = preprocess.memory_report(df).loc['total']
+    memory = {'frame_mb': total['bytes'] / 1024 / 1024,
+              'wide_frame_mb': total['wide_bytes'] / 1024 / 1024}
+    return timings, memory
+
+
+# Import statements at the top of app.py, what every start of the app runs
+def app_imports():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'),
+              encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+# Seconds a fresh interpreter takes for the import statements, from -X importtime
+def import_time(statements):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', '; '.join(statements)],
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    # "import time: self [us] | cumulative | name", top level modules are not indented
+    total = 0
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if line.startswith('import time:') and len(fields) == 3 and fields[1].strip().isdigit():
+            if not fields[2].startswith('  '):
+                total += int(fields[1])
+    return total / 1e6
+
+
+# Cold import times (name -> seconds) of the app and of its lazily imported libraries
+def import_times(repeat):
+    statements = {'app.py': app_imports()}
+    statements.update((module, ['import ' + module]) for module in LAZY_IMPORTS)
+    return {name: min(import_time(imports) for _ in range(repeat))
+            for name, imports in statements.items()}
+
+
+# Settings which change what a timing measures; sizes and --imports only pick what is timed
+COMPARED_SETTINGS = ['users', 'emoji_ratio', 'link_ratio', 'multiline_ratio', 'seed', 'repeat',
+                     'workers', 'sentiment']
+
+
+# Settings of results and baseline which differ, as report lines. Timings of runs which
+# differ in any are not comparable.
+def setting_differences(results, baseline):
+    if 'settings' not in baseline:
+        return ['the baseline has no settings']
+    return ['%s: %r vs %r baseline' % (name, results['settings'].get(name),
+                                       baseline['settings'].get(name))
+            for name in COMPARED_SETTINGS
+            if results['settings'].get(name) != baseline['settings'].get(name)]
+
+
+# Timings slower than the baseline's by more than threshold, as report lines
+def regressions(results, baseline, threshold):
+    lines = []
+    for size, timings in results['sizes'].items():
+        for name, seconds in timings.items():
+            base = baseline.get('sizes', {}).get(size, {}).get(name)
+            if base and seconds > base * (1 + threshold):
+                lines.append('%s @ %s: %.4fs vs %.4fs baseline (+%.0f%%)'
+                             % (name, size, seconds, base, (seconds / base - 1) * 100))
+    for name, seconds in results.get('imports', {}).items():
+        base = baseline.get('imports', {}).get(name)
+        if base and seconds > base * (1 + threshold):
+            lines.append('import %s: %.4fs vs %.4fs baseline (+%.0f%%)'
+                         % (name, seconds, base, (seconds / base - 1) * 100))
+    return lines
+
+
+def main(argv=None):
+    import sentiment
+
+    parser = argparse.ArgumentParser(description='Benchmark parsing, sentiment and helper functions.')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated message counts (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--emoji-ratio', type=float, default=0.1)
+    parser.add_argument('--link-ratio', type=float, default=0.02)
+    parser.add_argument('--multiline-ratio', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per timing, the best is kept')
+    parser.add_argument('--workers', type=int, default=1, help='sentiment scoring processes')
+    parser.add_argument('--sentiment', default='vader', choices=sorted(sentiment.BACKENDS),
+                        help='sentiment backend (default: %(default)s)')
+    parser.add_argument('--imports', action='store_true',
+                        help='time the imports of a cold start of the app instead')
+    parser.add_argument('--out', default='bench.json', help='result file (default: %(default)s)')
+    parser.add_argument('--baseline', help='result file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown against the baseline (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'settings': {name: value for name, value in vars(args).items()
+                     if name not in ('out', 'baseline', 'threshold')},
+        'sizes': {},
+        'memory': {},
+    }
+    if args.imports:
+        print('imports...', file=sys.stderr)
+        results['imports'] = import_times(args.repeat)
+        for name, seconds in results['imports'].items():
+            print('  %-36s %9.4fs' % (name, seconds), file=sys.stderr)
+
+    for size in [] if args.imports else [int(size) for size in args.sizes.split(',')]:
+        print('%d messages...' % size, file=sys.stderr)
+        results['sizes'][str(size)], results['memory'][str(size)] = run_size(size, args)
+        for name, seconds in results['sizes'][str(size)].items():
+            print('  %-36s %9.4fs' % (name, seconds), file=sys.stderr)
+        print('  %-36s %8.1fMB (%.1fMB with the wide schema)'
+              % ('frame memory', results['memory'][str(size)]['frame_mb'],
+                 results['memory'][str(size)]['wide_frame_mb']), file=sys.stderr)
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differences = setting_differences(results, baseline)
+        if differences:
+            for line in differences:
+                print('SETTINGS ' + line, file=sys.stderr)
+            print('not compared with %s, its run used other settings' % args.baseline,
+                  file=sys.stderr)
+            return 2
+        lines = regressions(results, baseline, args.threshold)
+        for line in lines:
+            print('REGRESSION ' + line, file=sys.stderr)
+        if lines:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# imports
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Memory budget of the result cache in MB, shared by every session of the server
+BUDGET_MB = int(os.environ.get('CHAT_CACHE_MB', '1024'))
+
+
+# Key of an uploaded file, a hash of its content
+def content_key(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+# Approximate memory taken by a value, including arrays kept in a frame's attrs
+def size_of(value, seen=None):
+    # Objects reachable twice (or in a cycle) are counted once
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, pd.DataFrame):
+        size = int(value.memory_usage(index=True, deep=True).sum())
+        for extra in value.attrs.values():
+            size += size_of(extra, seen)
+        return size
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        # Object arrays (vocabularies of the corpus index) hold pointers to their strings
+        if value.dtype == object:
+            return value.nbytes + sum(sys.getsizeof(item) for item in value)
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(size_of(item, seen) for item in value)
+    if isinstance(value, dict):
+        return sum(size_of(item, seen) for item in value.values())
+    if hasattr(value, '__dict__'):
+        return sum(size_of(item, seen) for item in vars(value).values())
+    return 0
+
+
+# Least recently used cache with a memory budget, safe to use from several sessions
+class ResultCache:
+
+    def __init__(self, budget_mb=BUDGET_MB):
+        self.budget = budget_mb * 1024 * 1024
+        self.used = 0
+        self.entries = OrderedDict()    # key -> (value, size)
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = size_of(value)
+        with self.lock:
+            self.discard(key)
+
+            # Values bigger than the whole budget are not kept
+            if size > self.budget:
+                return value
+
+            # Evicting least recently used entries until the new value fits
+            while self.entries and self.used + size > self.budget:
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.used -= old_size
+
+            self.entries[key] = (value, size)
+            self.used += size
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    # Remove an entry, the lock must be held
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.used -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used = 0
+
+
+# Cache of parsed and scored chats, lives as long as the server process
+results = ResultCache()
@@ -0,0 +1,336 @@
+# imports
+import re
+from urllib.parse import urlsplit
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import profiling
+
+# Key of the index in DataFrame.attrs and column holding each row's position in it
+ATTR = 'corpus'
+ID_COLUMN = 'msg_id'
+
+# URLExtract loads its TLD list when created, so it is only made when first needed
+_extract = None
+
+
+def get_extractor():
+    global _extract
+    if _extract is None:
+        from urlextract import URLExtract
+        _extract = URLExtract()
+    return _extract
+
+
+# Complete emoji, including multi code point ones (ZWJ sequences, skin tones, flags), are
+# found in two steps. A few character ranges holding the code points emoji start with find
+# candidate positions (keycaps are the only emoji starting with ASCII); the emoji starting
+# with the code point found are then matched there, longest first. An alternation of every
+# emoji tried at every position of every message was ~40x slower.
+CANDIDATE = re.compile('[#*0-9]\ufe0f?\u20e3|[\u00a9\u00ae\u203c-\ud7ff\ue000-\U0010ffff]')
+
+# first code point -> emoji starting with it, and their regular expression once needed
+_emoji_by_first = None
+_emoji_sequences = {}
+
+
+def get_emoji_by_first():
+    global _emoji_by_first
+    if _emoji_by_first is None:
+        import emoji
+        by_first = {}
+        for sequence in emoji.EMOJI_DATA:
+            by_first.setdefault(sequence[0], []).append(sequence)
+        _emoji_by_first = by_first
+    return _emoji_by_first
+
+
+# Regular expression of the emoji starting with first, None if no emoji starts with it
+def emoji_sequences(first):
+    pattern = _emoji_sequences.get(first)
+    if pattern is None:
+        sequences = get_emoji_by_first().get(first)
+        if sequences is None:
+            return None
+        pattern = _emoji_sequences[first] = re.compile(trie_pattern(sequences))
+    return pattern
+
+
+# Emoji of a text in order
+def find_emojis(text):
+    search = CANDIDATE.search
+    found = []
+    position = 0
+    while True:
+        candidate = search(text, position)
+        if candidate is None:
+            return found
+        start = candidate.start()
+        sequences = emoji_sequences(text[start])
+        match = None if sequences is None else sequences.match(text, start)
+        if match is None:
+            position = start + 1
+        else:
+            found.append(match.group())
+            position = match.end()
+
+
+# Emoji of every message as a Series of lists, only messages with a candidate code point
+# are scanned
+def find_all_emojis(messages):
+    candidates = messages.str.contains(CANDIDATE.pattern, na=False).to_numpy(dtype=bool)
+    emojis = pd.Series([[]] * len(messages), index=messages.index, dtype=object)
+    if candidates.any():
+        emojis[candidates] = messages[candidates].map(find_emojis)
+    return emojis
+
+
+# Regular expression matching any of words, longest first. The alternatives are nested
+# by common prefix, so the engine picks a branch by the next character instead of trying
+# thousands of alternatives at every position.
+def trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def pattern(node):
+        end = '' in node
+        branches = [re.escape(char) + pattern(child)
+                    for char, child in sorted(node.items()) if char != '']
+        if not branches:
+            return ''
+        if len(branches) == 1 and not end:
+            return branches[0]
+        body = '(?:' + '|'.join(branches) + ')'
+        return body + '?' if end else body
+
+    return pattern(trie)
+
+
+# Cheap test for text which may contain a link, URLExtract only finds links with a TLD
+_link_candidate = re.compile(r'\w\.\w')
+
+
+# Links of every message as a Series of lists
+def find_urls(messages):
+    candidates = messages.str.contains(_link_candidate, na=False)
+    urls = pd.Series([[]] * len(messages), index=messages.index, dtype=object)
+    if candidates.any():
+        extract = get_extractor()
+        urls[candidates] = messages[candidates].map(extract.find_urls)
+    return urls
+
+
+# Host name of a link, without "www."
+def domain_of(url):
+    if '://' not in url:
+        url = '//' + url
+    try:
+        host = urlsplit(url).hostname or ''
+    except ValueError:
+        host = ''
+    return host[4:] if host.startswith('www.') else host
+
+
+# Flattens a Series of lists into (codes, vocabulary, offsets) arrays
+# codes[offsets[i]:offsets[i + 1]] are the items of message i
+def flatten(lists):
+    lengths = lists.str.len().fillna(0).to_numpy(dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    items = lists.explode().dropna()
+    codes, vocab = pd.factorize(items.to_numpy(dtype=object))
+    return codes.astype(np.int32), np.asarray(vocab, dtype=object), offsets
+
+
+# Lower case words of every message as (codes, vocabulary, offsets) arrays, like flatten of
+# str.lower().str.split(). Arrow splits the messages, so only the distinct words become
+# Python strings, not every word of the chat.
+def split_words(messages):
+    lists = pc.utf8_split_whitespace(pc.utf8_lower(pc.utf8_trim_whitespace(text_array(messages))))
+
+    # Empty messages split into one empty word
+    words = lists.flatten()
+    keep = pc.not_equal(words, '')
+    words = words.filter(keep)
+    owner = pc.list_parent_indices(lists).filter(keep).to_numpy()
+
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owner, minlength=len(lists)), out=offsets[1:])
+
+    # Codes in order of first appearance, like pd.factorize
+    encoded = words.dictionary_encode()
+    vocab = np.asarray(encoded.dictionary.to_pylist(), dtype=object)
+    return encoded.indices.to_numpy().astype(np.int32), vocab, offsets
+
+
+# Messages as one Arrow string array
+def text_array(messages):
+    values = pa.array(messages, type=pa.large_string(), from_pandas=True)
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    return values
+
+
+# Message number of every item of a flattened column
+def owners(offsets):
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+
+
+# Tokens, emojis and links of every message, computed once and shared by helper functions.
+# Row i of the data frame it was built from is message i of the index.
+class CorpusIndex:
+
+    # Names of the arrays which make up the index
+    ARRAYS = ['tokens', 'vocab', 'token_offsets', 'emojis', 'emoji_vocab', 'emoji_offsets',
+              'urls', 'url_vocab', 'url_offsets']
+
+    def __init__(self, messages=None, arrays=None):
+        # stop word set -> mask over vocab
+        self.stop_masks = {}
+
+        if arrays is not None:
+            # Index saved before, see to_arrays
+            for name in self.ARRAYS:
+                setattr(self, name, arrays[name])
+            self.size = len(self.token_offsets) - 1
+            self.token_owner = owners(self.token_offsets)
+            self.emoji_owner = owners(self.emoji_offsets)
+            return
+
+        messages = pd.Series(messages, dtype=str).reset_index(drop=True)
+        self.size = len(messages)
+
+        # Lower case words
+        self.tokens, self.vocab, self.token_offsets = split_words(messages)
+        self.token_owner = owners(self.token_offsets)
+
+        # Emojis
+        self.emojis, self.emoji_vocab, self.emoji_offsets = flatten(find_all_emojis(messages))
+        self.emoji_owner = owners(self.emoji_offsets)
+
+        # Links, only messages which could hold a host name ("word.word") go to URLExtract
+        self.urls, self.url_vocab, self.url_offsets = flatten(find_urls(messages))
+
+    # Arrays to save the index with, CorpusIndex(arrays=...) builds it again
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    # The index is never modified, so copies of a data frame can share it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    # Boolean mask over messages, True for the given message ids
+    def selection(self, ids):
+        selected = np.zeros(self.size, dtype=bool)
+        selected[ids] = True
+        return selected
+
+    # Number of words in the given messages
+    def word_count(self, ids):
+        return int(np.diff(self.token_offsets)[ids].sum())
+
+    # Number of links in the given messages
+    def link_count(self, ids):
+        return int(np.diff(self.url_offsets)[ids].sum())
+
+    # Number of links in every message
+    def link_counts(self):
+        return np.diff(self.url_offsets)
+
+    # Frequency of every link domain in the given messages, most common first
+    def domain_frequencies(self, ids):
+        urls = self.urls[self.selection(ids)[owners(self.url_offsets)]]
+        domains, vocab = pd.factorize(np.array([domain_of(url) for url in self.url_vocab], dtype=object))
+        counts = np.bincount(domains[urls], minlength=len(vocab))
+        return most_common(counts, np.asarray(vocab, dtype=object))
+
+    # Frequency of every word in the given messages, most common first
+    def word_frequencies(self, ids, stop_words=frozenset()):
+        tokens = self.tokens[self.selection(ids)[self.token_owner]]
+        counts = np.bincount(tokens, minlength=len(self.vocab))
+        counts[self.stop_mask(stop_words)] = 0
+        return most_common(counts, self.vocab)
+
+    # Frequency of every emoji in the given messages, most common first
+    def emoji_frequencies(self, ids):
+        return most_common(self.emoji_counts(ids)[0], self.emoji_vocab)
+
+    # Count of every emoji of emoji_vocab in the given messages, split by group in one pass.
+    # groups holds the group number (0 to n_groups - 1) of every message of the index,
+    # the result has one row per group.
+    def emoji_counts(self, ids, groups=None, n_groups=1):
+        selected = self.selection(ids)[self.emoji_owner]
+        emojis = self.emojis[selected].astype(np.int64)
+        size = len(self.emoji_vocab)
+        if groups is not None:
+            emojis += groups[self.emoji_owner[selected]].astype(np.int64) * size
+        return np.bincount(emojis, minlength=n_groups * size).reshape(n_groups, size)
+
+    # True for every vocabulary word which is a stop word
+    def stop_mask(self, stop_words):
+        mask = self.stop_masks.get(stop_words)
+        if mask is None:
+            mask = np.fromiter((word in stop_words for word in self.vocab), dtype=bool,
+                               count=len(self.vocab))
+            self.stop_masks[stop_words] = mask
+        return mask
+
+
+# Non zero counts as a Series, most common first (ties keep first appearance order)
+def most_common(counts, vocab):
+    order = np.argsort(-counts, kind='stable')
+    order = order[counts[order] > 0]
+    return pd.Series(counts[order], index=vocab[order])
+
+
+# Index of data frames put one after the other, from their own indexes
+def merge(*indexes):
+    arrays = {}
+    for codes, vocab, offsets in [('tokens', 'vocab', 'token_offsets'),
+                                  ('emojis', 'emoji_vocab', 'emoji_offsets'),
+                                  ('urls', 'url_vocab', 'url_offsets')]:
+        # Items keep the code of their first appearance, later indexes are recoded to it
+        vocabs = [getattr(index, vocab) for index in indexes]
+        merged = np.asarray(pd.unique(np.concatenate(vocabs)), dtype=object)
+        known = pd.Index(merged, dtype=object)
+
+        parts = []
+        parts_offsets = [np.zeros(1, dtype=np.int64)]
+        for index, items in zip(indexes, vocabs):
+            recode = known.get_indexer(items)
+            parts.append(recode[getattr(index, codes)].astype(np.int32))
+            parts_offsets.append(parts_offsets[-1][-1] + getattr(index, offsets)[1:])
+
+        arrays[vocab] = merged
+        arrays[codes] = np.concatenate(parts)
+        arrays[offsets] = np.concatenate(parts_offsets)
+    return CorpusIndex(arrays=arrays)
+
+
+# Store the index of a preprocessed data frame with the frame, built when not given.
+# The frame is changed in place, it is the parser's own.
+@profiling.profiled()
+def attach(df, index=None):
+    df[ID_COLUMN] = np.arange(df.shape[0], dtype=np.int32)
+    df.attrs[ATTR] = CorpusIndex(df['message']) if index is None else index
+
+    # Number of links of every message
+    df['links'] = df.attrs[ATTR].link_counts().astype(np.int32)
+    return df
+
+
+# Index of a (possibly filtered) data frame and the message ids of its rows
+def lookup(df):
+    index = df.attrs.get(ATTR)
+    if index is None or ID_COLUMN not in df:
+        return CorpusIndex(df['message']), np.arange(df.shape[0])
+    return index, df[ID_COLUMN].to_numpy()
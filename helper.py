@@ -1,143 +1,185 @@
+import numpy as np
 import pandas as pd
-from urlextract import URLExtract
-from wordcloud import WordCloud
-from collections import Counter
-import emoji
+import aggregate
+import corpus
+import profiling
+import stopwords
 
-extract = URLExtract()
-def fetch_stats(user_selected, df):
+# Words drawn in a word cloud at most, bounds its render time
+WORDCLOUD_WORDS = 150
 
-    if user_selected != "Overall":
+# Every function takes the selected user and, for frames of several chats, the selected
+# chat; 'Overall' stands for all of them
+
+# Messages of the selected user in the selected chat
+def select_rows(df, user_selected, chat_selected='Overall'):
+    if user_selected != 'Overall':
         df = df[df['user'] == user_selected]
+    if chat_selected != 'Overall':
+        df = df[df[aggregate.CHAT] == chat_selected]
+    return df
+
+@profiling.profiled()
+def fetch_stats(user_selected, df, chat_selected='Overall'):
+
+    df = select_rows(df, user_selected, chat_selected)
+
+    # words and links are read from the corpus index
+    index, ids = corpus.lookup(df)
 
     # fetch no of msgs
     num_msgs = df.shape[0]
 
     # no of words
-    words = []
-    for msg in df["message"]:
-        words.extend(msg.split())
+    words = index.word_count(ids)
 
     # fetch no. of media using media omitted
     num_media = df[df["message"] == '<Media omitted>\n'].shape[0]
 
     # fetch no. of links
-    links = []
-    for msg in df['message']:
-        links.extend(extract.find_urls(msg))
+    links = int(df['links'].sum()) if 'links' in df else index.link_count(ids)
+
+    return num_msgs, words, links, num_media
 
-    return num_msgs, len(words), len(links), num_media
+# Number of links shared per domain, most shared first
+@profiling.profiled()
+def link_domains(user_selected, df, chat_selected='Overall'):
 
-def most_active_user(df):
-    x = df['user'].value_counts().head()
-    df = round((df['user'].value_counts() / df.shape[0]) * 100, 2).reset_index()
-    df = df.rename(columns={'index': 'name', 'user': 'percent'})
+    df = select_rows(df, user_selected, chat_selected)
+
+    index, ids = corpus.lookup(df)
+    domains = index.domain_frequencies(ids)
+    return pd.DataFrame({'domain': domains.index, 'links': domains.values})
+
+# Messages per user, most first. Users are categories, those without messages are left out.
+def user_counts(users):
+    counts = users.value_counts()
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(str)
+    return counts
+
+@profiling.profiled()
+def most_active_user(df, chat_selected='Overall'):
+    df = select_rows(df, 'Overall', chat_selected)
+    x = user_counts(df['user']).head()
+    df = round((user_counts(df['user']) / df.shape[0]) * 100, 2).reset_index()
+    df = df.rename(columns={'user': 'name', 'count': 'percent'})
     return x, df
 
-def create_wordcloud(user_selected, df):
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
-    if user_selected != 'Overall':
-        df = df[df['user'] == user_selected]
+# Frequency of every word (without stop words) in the messages of the selected user,
+# and of sentiment k if given, most common first. Word clouds and most common words
+# are both made from this table.
+@profiling.profiled()
+def word_frequencies(user_selected, df, k=None, chat_selected='Overall'):
+    stop_words = stopwords.get_stop_words()
+    df = select_rows(df, user_selected, chat_selected)
 
     # Remove entries of no significance
     temp = df[df['user'] != 'group_notification']
     temp = temp[temp['message'] != '<Media omitted>\n']
+    if k is not None:
+        temp = temp[temp['value'] == k]
 
     # Remove stop words according to text file "stop_hinglish.txt"
-    def remove_stop_words(message):
-        y = []
-        for word in message.lower().split():
-            if word not in stop_words:
-                y.append(word)
-        return " ".join(y)
+    index, ids = corpus.lookup(temp)
+    return index.word_frequencies(ids, stop_words)
+
+
+# Words of a frequency table as WordCloud.process_text splits text: runs of word characters
+# and apostrophes without a trailing 's, numbers and single characters left out, and a plural
+# counted with its singular when both are there. Stop words are left out, the max_words most
+# common words are kept.
+def cloud_words(frequencies, max_words=WORDCLOUD_WORDS):
+    from wordcloud import STOPWORDS
+    table = pd.DataFrame({'word': pd.Series(frequencies.index, dtype=str).str.findall(r"\w[\w']+"),
+                          'count': frequencies.to_numpy()}).explode('word').dropna()
+    words = table['word'].str.replace(r"'s$", '', regex=True)
+    keep = ~words.str.isdigit() & (words.str.len() > 1)
+    counts = table['count'][keep].groupby(words[keep].to_numpy(), sort=False).sum()
+
+    words = counts.index
+    plural = (words.str.endswith('s') & ~words.str.endswith('ss')
+              & words.str[:-1].isin(words))
+    counts = counts.groupby(np.where(plural, words.str[:-1], words), sort=False).sum()
+
+    stop_words = STOPWORDS | stopwords.get_stop_words()
+    counts = counts[~counts.index.isin(stop_words)]
+    return counts.sort_values(ascending=False, kind='stable').head(max_words)
+
+
+# Word cloud of the max_words most frequent words, without WordCloud's own stop words
+@profiling.profiled()
+def wordcloud_from_frequencies(frequencies, width=500, height=500, max_words=WORDCLOUD_WORDS):
+    # wordcloud loads matplotlib, so it is only imported for the first word cloud
+    from wordcloud import WordCloud
+    frequencies = cloud_words(frequencies, max_words)
 
     # Dimensions of wordcloud
-    wc = WordCloud(width=500, height=500, min_font_size=10, background_color='white')
-
-    # Actual removing
-    temp['message'] = temp['message'].apply(remove_stop_words)
+    wc = WordCloud(width=width, height=height, min_font_size=10, background_color='white',
+                   max_words=max_words)
 
     # Word cloud generated
-    df_wc = wc.generate(temp['message'].str.cat(sep=" "))
-    return df_wc
+    return wc.generate_from_frequencies(frequencies.to_dict())
 
 
-def most_common_used_words(user_selected, df):
+@profiling.profiled()
+def create_wordcloud(user_selected, df, width=500, height=500, chat_selected='Overall'):
+    return wordcloud_from_frequencies(word_frequencies(user_selected, df, chat_selected=chat_selected),
+                                      width, height)
 
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
 
-    if user_selected != "Overall":
-        df = df[df['user'] == user_selected]
-    temp = df[df['user'] != 'group_notification']      # removing these
-    temp = temp[temp['message'] != '<Media omitted>\n']       # removing links
-
-    words = []
-    # removing stop words
-    for msg in temp['message']:
-        for word in msg.lower().split():
-            if word not in stop_words:
-                words.append(word)
+@profiling.profiled()
+def most_common_used_words(user_selected, df, chat_selected='Overall'):
 
     # choosing the most 20 used words
-    most_common_df = pd.DataFrame(Counter(words).most_common(20))
+    frequencies = word_frequencies(user_selected, df, chat_selected=chat_selected)
+    most_common_df = frequency_frame(frequencies.head(20))
     return most_common_df
 
-def emoji_helper(user_selected, df):
+@profiling.profiled()
+def emoji_helper(user_selected, df, chat_selected='Overall'):
 
-    if user_selected != "Overall":
-        df = df[df['user'] == user_selected]
+    df = select_rows(df, user_selected, chat_selected)
 
     # Collecting emojis
-    emojis = []
-    for message in df['message']:
-        emojis.extend([c for c in message if c in emoji.EMOJI_DATA])
-    emoji_df = pd.DataFrame(Counter(emojis).most_common(len(Counter(emojis))))
-    return emoji_df
-
-# How many chats per month
-def monthly_timeline(user_selected, df):
-
-    if user_selected != "Overall":
-        df = df[df['user'] == user_selected]
-    timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
-
-    time = []
-    for i in range(timeline.shape[0]):
-        time.append(timeline['month'][i] + "-" + str(timeline['year'][i]))
-    timeline['time'] = time
-    return timeline
-
-def daily_timeline(user_selected, df):
-
-    if user_selected != "Overall":
-        df = df[df['user'] == user_selected]
-
-    daily_timeline = df.groupby('only_date').count()['message'].reset_index()
-    return daily_timeline
+    index, ids = corpus.lookup(df)
+    if 'value' not in df:
+        return frequency_frame(index.emoji_frequencies(ids))
 
-def week_activity_map(user_selected, df):
+    # Counts per sentiment in the same pass, -1/0/1 => rows 0/1/2
+    groups = np.zeros(index.size, dtype=np.int8)
+    groups[ids] = df['value'].to_numpy() + 1
+    counts = index.emoji_counts(ids, groups, 3)
 
-    if user_selected != "Overall":
-        df = df[df['user'] == user_selected]
+    emoji_df = pd.DataFrame({0: index.emoji_vocab, 1: counts.sum(axis=0),
+                             'Positive': counts[2], 'Neutral': counts[1], 'Negative': counts[0]})
+    emoji_df = emoji_df[emoji_df[1] > 0].sort_values(1, ascending=False, kind='stable')
+    return emoji_df.reset_index(drop=True)
 
-    return df['day_name'].value_counts()
+# (item, count) rows numbered 0 and 1, like DataFrame(Counter.most_common())
+def frequency_frame(frequencies):
+    return pd.DataFrame({0: frequencies.index, 1: frequencies.values})
 
-def month_activity_map(user_selected, df):
+# How many chats per month
+@profiling.profiled()
+def monthly_timeline(user_selected, df, chat_selected='Overall'):
+    return month_counts(aggregate.lookup(df).select(user_selected, None, chat_selected))
 
-    if user_selected != "Overall":
-        df = df[df['user'] == user_selected]
+@profiling.profiled()
+def daily_timeline(user_selected, df, chat_selected='Overall'):
+    return date_counts(aggregate.lookup(df).select(user_selected, None, chat_selected))
 
-    return df['month'].value_counts()
+@profiling.profiled()
+def week_activity_map(user_selected, df, chat_selected='Overall'):
+    return label_counts(aggregate.lookup(df).select(user_selected, None, chat_selected), 'day_name')
 
-def activity_heatmap(user_selected, df):
+@profiling.profiled()
+def month_activity_map(user_selected, df, chat_selected='Overall'):
+    return label_counts(aggregate.lookup(df).select(user_selected, None, chat_selected), 'month')
 
-    if user_selected != "Overall":
-        df = df[df['user'] == user_selected]
-    user_heatmap = df.pivot_table(index='day_name', columns='period',
-                                  aggfunc='count', fill_value=0)['message']
-    return user_heatmap
+@profiling.profiled()
+def activity_heatmap(user_selected, df, chat_selected='Overall'):
+    return heatmap_counts(aggregate.lookup(df).select(user_selected, None, chat_selected))
 
 
 # -1 => Negative
@@ -145,108 +187,109 @@ def activity_heatmap(user_selected, df):
 # 1 => Positive
 
 # Will return count of messages of selected user per day having k(0/1/-1) sentiment
-def week_activity_map_sentiment(selected_user, df, k):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    df = df[df['value'] == k]
-    return df['day_name'].value_counts()
+@profiling.profiled()
+def week_activity_map_sentiment(selected_user, df, k, chat_selected='Overall'):
+    return label_counts(aggregate.lookup(df).select(selected_user, k, chat_selected), 'day_name')
 
 
 # Will return count of messages of selected user per month having k(0/1/-1) sentiment
-def month_activity_map_sentiment(selected_user, df, k):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    df = df[df['value'] == k]
-    return df['month'].value_counts()
+@profiling.profiled()
+def month_activity_map_sentiment(selected_user, df, k, chat_selected='Overall'):
+    return label_counts(aggregate.lookup(df).select(selected_user, k, chat_selected), 'month')
 
 
 # Will return hear map containing count of messages having k(0/1/-1) sentiment
-def activity_heatmap_sentiment(selected_user, df, k):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    df = df[df['value'] == k]
-
-    # Creating heat map
-    user_heatmap = df.pivot_table(index='day_name', columns='period', values='message', aggfunc='count').fillna(0)
-    return user_heatmap
+@profiling.profiled()
+def activity_heatmap_sentiment(selected_user, df, k, chat_selected='Overall'):
+    return heatmap_counts(aggregate.lookup(df).select(selected_user, k, chat_selected))
 
 
 # Will return count of messages of selected user per date having k(0/1/-1) sentiment
-def daily_timeline_sentiment(selected_user, df, k):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    df = df[df['value'] == k]
-    # count of message on a specific date
-    daily_timeline = df.groupby('only_date').count()['message'].reset_index()
-    return daily_timeline
+@profiling.profiled()
+def daily_timeline_sentiment(selected_user, df, k, chat_selected='Overall'):
+    return date_counts(aggregate.lookup(df).select(selected_user, k, chat_selected))
 
 
 # Will return count of messages of selected user per {year + month number + month} having k(0/1/-1) sentiment
-def monthly_timeline_sentiment(selected_user, df, k):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    df = df[df['value'] == -k]
-    timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
-    time = []
-    for i in range(timeline.shape[0]):
-        time.append(timeline['month'][i] + "-" + str(timeline['year'][i]))
-    timeline['time'] = time
-    return timeline
+@profiling.profiled()
+def monthly_timeline_sentiment(selected_user, df, k, chat_selected='Overall'):
+    return month_counts(aggregate.lookup(df).select(selected_user, k, chat_selected))
 
 
-# Will return percentage of message contributed having k(0/1/-1) sentiment
-def percentage_sentiment(df, k):
-    df = round((df['user'][df['value'] == k].value_counts() / df[df['value'] == k].shape[0]) * 100,
-               2).reset_index().rename(
-        columns={'index': 'name', 'user': 'percent'})
-    return df
+# Sums over rows of the aggregate cube
 
+# count of message per {year + month number + month}, with a "month-year" time label
+def month_counts(cube):
+    timeline = cube.groupby(['year', 'month_num', 'month'], observed=True)['count'].sum()
+    timeline = timeline.rename('message').reset_index()
+    timeline['time'] = timeline['month'].astype(str) + "-" + timeline['year'].astype(str)
+    return timeline
 
-# Return wordcloud from words in message
-def create_wordcloud_sentiment(selected_user, df, k):
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+# count of message on a specific date
+def date_counts(cube):
+    return cube.groupby('only_date')['count'].sum().rename('message').reset_index()
 
-    # Remove entries of no significance
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
+# count of message per day name / month name, most busy first; like value_counts(), days
+# and months without messages are left out
+def label_counts(cube, column):
+    counts = cube.groupby(column, observed=True)['count'].sum()
+    return counts.sort_values(ascending=False, kind='stable').rename('count')
 
-    # Remove stop words according to text file "stop_hinglish.txt"
-    def remove_stop_words(message):
-        y = []
-        for word in message.lower().split():
-            if word not in stop_words:
-                y.append(word)
-        return " ".join(y)
+# count of message per day name and period
+def heatmap_counts(cube):
+    return cube.pivot_table(index='day_name', columns='period', values='count', aggfunc='sum',
+                            fill_value=0, observed=False)
 
-    # Dimensions of wordcloud
-    wc = WordCloud(width=500, height=500, min_font_size=10, background_color='white')
 
-    # Actual removing
-    temp['message'] = temp['message'].apply(remove_stop_words)
-    temp['message'] = temp['message'][temp['value'] == k]
+# Will return percentage of message contributed having k(0/1/-1) sentiment
+@profiling.profiled()
+def percentage_sentiment(df, k, chat_selected='Overall'):
+    df = select_rows(df, 'Overall', chat_selected)
+    df = round((user_counts(df['user'][df['value'] == k]) / df[df['value'] == k].shape[0]) * 100,
+               2).reset_index().rename(
+        columns={'user': 'name', 'count': 'percent'})
+    return df
 
-    # Word cloud generated
-    df_wc = wc.generate(temp['message'].str.cat(sep=" "))
-    return df_wc
+
+# Return wordcloud from words in message
+@profiling.profiled()
+def create_wordcloud_sentiment(selected_user, df, k, width=500, height=500, chat_selected='Overall'):
+    return wordcloud_from_frequencies(word_frequencies(selected_user, df, k, chat_selected), width, height)
 
 
 # Return set of most common words having k(0/1/-1) sentiment
-def most_common_words_sentiment(selected_user, df, k):
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
-    words = []
-    for message in temp['message'][temp['value'] == k]:
-        for word in message.lower().split():
-            if word not in stop_words:
-                words.append(word)
+@profiling.profiled()
+def most_common_words_sentiment(selected_user, df, k, chat_selected='Overall'):
 
     # Creating data frame of most common 20 entries
-    most_common_df = pd.DataFrame(Counter(words).most_common(20))
+    most_common_df = frequency_frame(word_frequencies(selected_user, df, k, chat_selected).head(20))
     return most_common_df
+
+
+# Comparison of chats, for frames of several chats
+
+# Messages, words, links, media and active users of the selected user in every chat
+@profiling.profiled()
+def chat_stats(user_selected, df):
+    df = select_rows(df, user_selected)
+    index, ids = corpus.lookup(df)
+    rows = pd.DataFrame({
+        'chat': df[aggregate.CHAT],
+        'words': np.diff(index.token_offsets)[ids],
+        'links': df['links'] if 'links' in df else np.diff(index.url_offsets)[ids],
+        'media': df['message'] == '<Media omitted>\n',
+        'user': df['user'],
+    })
+    stats = rows.groupby('chat', observed=False).agg(
+        messages=('words', 'size'), words=('words', 'sum'), links=('links', 'sum'),
+        media=('media', 'sum'), users=('user', 'nunique'))
+    return stats.reset_index()
+
+# Messages of the selected user per month (rows) in every chat (columns), from the cube
+@profiling.profiled()
+def chat_timeline(user_selected, df):
+    cube = aggregate.lookup(df).select(user_selected)
+    timeline = cube.pivot_table(index=['year', 'month_num', 'month'], columns=aggregate.CHAT,
+                                values='count', aggfunc='sum', fill_value=0, observed=True)
+    timeline.index = [month + "-" + str(year) for year, _, month in timeline.index]
+    return timeline.reindex(columns=df[aggregate.CHAT].cat.categories, fill_value=0)
@@ -0,0 +1,168 @@
+# Chats loaded in background threads, so the app keeps drawing while a large upload is
+# parsed and scored: the stage running, how far it got, and the stats and timelines of the
+# messages parsed so far.
+#
+#     job = jobs.submit(key, lambda progress: pipeline.load(data, key, progress))
+#     job.progress.snapshot()    # {'stage': 'sentiment', 'done': 20000, 'total': 80000, ...}
+#     job.result()               # the analyzed frame, once job.done()
+#
+# One job runs per key at a time, every session uploading the same chats shares it. Callers
+# keep results in a cache of their own: a finished job is forgotten, and submitting the key
+# again starts a new one.
+
+# imports
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Chats loaded at once, by every session of the server together
+WORKERS = int(os.environ.get('CHAT_JOB_WORKERS', '2'))
+
+_executor = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix='chat-job')
+
+# Start method of the worker processes of jobs (sentiment scoring, chats analyzed at once).
+# Forking a process whose other threads hold locks can leave the child stuck on them, so
+# workers are started by a fork server, or spawned where there is none.
+PROCESS_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# key -> Job, while it runs
+_jobs = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+# Worker processes a caller may start: every CPU, or its share of them when called from a
+# job, so the WORKERS jobs running at once start no more processes than there are CPUs
+def max_processes():
+    cpus = os.cpu_count() or 1
+    if getattr(_local, 'job', None) is None:
+        return cpus
+    return max(1, cpus // max(1, WORKERS))
+
+
+# Progress of a job, written by the job's thread and read by the app's
+class Progress:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stage = None
+        self.stage_started = self.started
+        self.done = 0
+        self.total = 0
+        self.finished = []      # (stage, seconds) of the stages done
+        self.partial = None
+
+    # A new stage starts, of total steps when they are counted
+    def start(self, stage, total=0):
+        now = time.perf_counter()
+        with self.lock:
+            if self.stage is not None:
+                self.finished.append((self.stage, now - self.stage_started))
+            self.stage = stage
+            self.stage_started = now
+            self.done = 0
+            self.total = total
+
+    # Number of steps of the stage, once known
+    def expect(self, total):
+        with self.lock:
+            self.total = total
+
+    def advance(self, steps=1):
+        with self.lock:
+            self.done += steps
+
+    # Frame of the parsed messages, before sentiment is scored. A shallow copy of its own,
+    # so the aggregates the app adds to its attrs do not race with the job.
+    def parsed(self, df):
+        partial = df.copy(deep=False)
+        with self.lock:
+            self.partial = partial
+
+    # The parsed frame goes with the last stage, only the result is kept once the job is done
+    def finish(self):
+        self.start(None)
+        with self.lock:
+            self.partial = None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'stage': self.stage,
+                'done': self.done,
+                'total': self.total,
+                'seconds': time.perf_counter() - self.stage_started,
+                'finished': list(self.finished),
+                'partial': self.partial,
+            }
+
+
+# Progress of calls made without a job, nothing is recorded
+class _NoProgress:
+
+    def start(self, stage, total=0):
+        pass
+
+    def expect(self, total):
+        pass
+
+    def advance(self, steps=1):
+        pass
+
+    def parsed(self, df):
+        pass
+
+
+NO_PROGRESS = _NoProgress()
+
+
+class Job:
+
+    def __init__(self, key):
+        self.key = key
+        self.progress = Progress()
+        self.future = None
+
+    def done(self):
+        return self.future.done()
+
+    # Whether the job is done after waiting for it at most seconds
+    def wait(self, seconds):
+        wait([self.future], timeout=seconds)
+        return self.future.done()
+
+    # Value returned by the job, or the exception it raised
+    def result(self):
+        return self.future.result()
+
+
+# Job running for key, None if there is none
+def running(key):
+    with _lock:
+        return _jobs.get(key)
+
+
+# Run load(progress) in a background thread, or return the job already running for key
+def submit(key, load):
+    with _lock:
+        job = _jobs.get(key)
+        if job is not None:
+            return job
+        job = _jobs[key] = Job(key)
+
+        def run():
+            _local.job = job
+            try:
+                return load(job.progress)
+            finally:
+                _local.job = None
+                job.progress.finish()
+                with _lock:
+                    _jobs.pop(key, None)
+
+        job.future = _executor.submit(run)
+    return job
@@ -1,16 +1,184 @@
-# This is a sample Python script.
+# Command line analysis of many exported chats at once, e.g. for nightly reports:
+#
+#     python main.py exports/ "archive/2024-*.txt" --out reports --format json --workers 8
+#
+# Every export is parsed, scored and summarized with the same helper functions as the
+# Streamlit app, and one summary per chat is written to the output folder.
 
-# Press Shift+F10 to execute it or replace it with your code.
-# Press Double Shift to search everywhere for classes, files, tool windows, actions, and settings.
+# imports
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
 
 
-def print_hi(name):
-    # Use a breakpoint in the code line below to debug your script.
-    print(f'Hi, {name}')  # Press Ctrl+F8 to toggle the breakpoint.
+# Export files named by the arguments, folders are searched for .txt files
+def find_exports(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '**', '*.txt'), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        paths.extend(sorted(path for path in matches if os.path.isfile(path)))
 
+    # Same file named twice is analyzed once
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+# Output name of every export, file names made unique if they clash
+def output_names(paths):
+    names = {}
+    used = set()
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name = stem
+        n = 2
+        while name in used:
+            name = '%s-%d' % (stem, n)
+            n += 1
+        used.add(name)
+        names[path] = name
+    return names
+
+
+# All statistics of the app for the whole chat, as tables with string column names
+def summary_tables(df):
+    import helper
+
+    num_msgs, words, num_links, num_media = helper.fetch_stats('Overall', df)
+    users = helper.user_counts(df['user'])
+    tables = {
+        'stats': pd.DataFrame([{'messages': num_msgs, 'words': words,
+                                'links': num_links, 'media': num_media}]),
+        'users': pd.DataFrame({'user': users.index, 'messages': users.values}),
+        'most_common_words': helper.most_common_used_words('Overall', df).rename(
+            columns={0: 'word', 1: 'count'}),
+        'emoji': helper.emoji_helper('Overall', df).rename(columns={0: 'emoji', 1: 'count'}),
+        'link_domains': helper.link_domains('Overall', df),
+        'monthly_timeline': helper.monthly_timeline('Overall', df),
+        'daily_timeline': helper.daily_timeline('Overall', df),
+        'week_activity': series_table(helper.week_activity_map('Overall', df)),
+        'month_activity': series_table(helper.month_activity_map('Overall', df)),
+        'activity_heatmap': heatmap_table(helper.activity_heatmap('Overall', df)),
+    }
+
+    for k, label in [(1, 'positive'), (0, 'neutral'), (-1, 'negative')]:
+        tables['percentage_' + label] = helper.percentage_sentiment(df, k)
+        tables['most_common_words_' + label] = helper.most_common_words_sentiment(
+            'Overall', df, k).rename(columns={0: 'word', 1: 'count'})
+        tables['monthly_timeline_' + label] = helper.monthly_timeline_sentiment('Overall', df, k)
+        tables['daily_timeline_' + label] = helper.daily_timeline_sentiment('Overall', df, k)
+        tables['week_activity_' + label] = series_table(
+            helper.week_activity_map_sentiment('Overall', df, k))
+        tables['month_activity_' + label] = series_table(
+            helper.month_activity_map_sentiment('Overall', df, k))
+        tables['activity_heatmap_' + label] = heatmap_table(
+            helper.activity_heatmap_sentiment('Overall', df, k))
+
+    for table in tables.values():
+        table.columns = [str(column) for column in table.columns]
+    return tables
+
+
+# (label, count) table of a value_counts like Series
+def series_table(counts):
+    return pd.DataFrame({'name': counts.index.astype(str), 'count': counts.values})
+
+
+# Heat map with the day name as a column instead of the index
+def heatmap_table(heatmap):
+    table = heatmap.copy()
+    table.columns = table.columns.astype(str)
+    table.index = table.index.astype(str)
+    return table.rename_axis('day_name').reset_index()
+
+
+def write_json(tables, path):
+    summary = {name: json.loads(table.to_json(orient='records', date_format='iso'))
+               for name, table in tables.items()}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=1)
 
-# Press the green button in the gutter to run the script.
-if __name__ == '__main__':
-    print_hi('PyCharm')
 
-# See PyCharm help at https://www.jetbrains.com/help/pycharm/
+def write_parquet(tables, folder):
+    os.makedirs(folder, exist_ok=True)
+    for name, table in tables.items():
+        table.to_parquet(os.path.join(folder, name + '.parquet'), index=False)
+
+
+# Analyze one export and write its summary, runs in a worker process
+# layout is the name of a date layout of preprocess.LAYOUTS, None detects it per export
+# backend is the name of a sentiment backend, None for sentiment.BACKEND
+def process(path, name, out_dir, fmt, layout=None, backend=None):
+    import pipeline
+    import preprocess
+
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        # Sentiment is scored in this process, the exports are what runs in parallel
+        df = pipeline.analyze(f, workers=1, layout=preprocess.LAYOUTS_BY_NAME.get(layout),
+                              backend=backend)
+    tables = summary_tables(df)
+
+    if fmt == 'json':
+        target = os.path.join(out_dir, name + '.json')
+        write_json(tables, target)
+    else:
+        target = os.path.join(out_dir, name)
+        write_parquet(tables, target)
+    return target, df.shape[0], time.perf_counter() - start
+
+
+def main(argv=None):
+    import preprocess
+    import sentiment
+
+    parser = argparse.ArgumentParser(
+        description='Analyze exported WhatsApp chats and write a summary of each.')
+    parser.add_argument('exports', nargs='+', help='export files, folders or glob patterns')
+    parser.add_argument('--out', default='reports', help='output folder (default: %(default)s)')
+    parser.add_argument('--format', choices=['json', 'parquet'], default='json',
+                        help='summary format (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of chats analyzed at once (default: %(default)s)')
+    parser.add_argument('--date-layout', choices=list(preprocess.LAYOUTS_BY_NAME),
+                        help='date layout of the exports, e.g. android-us for month first dates '
+                             '(default: detected per export)')
+    parser.add_argument('--sentiment', choices=list(sentiment.BACKENDS), default=sentiment.BACKEND,
+                        help='sentiment backend (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    paths = find_exports(args.exports)
+    if not paths:
+        parser.error('no export files found')
+    os.makedirs(args.out, exist_ok=True)
+    names = output_names(paths)
+
+    failed = 0
+    done = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(process, path, names[path], args.out, args.format, args.date_layout,
+                               args.sentiment): path
+                   for path in paths}
+        for future in as_completed(futures):
+            done += 1
+            path = futures[future]
+            try:
+                target, messages, seconds = future.result()
+            except Exception as error:
+                failed += 1
+                print('[%d/%d] FAILED %s: %s' % (done, len(paths), path, error), file=sys.stderr)
+            else:
+                print('[%d/%d] %s: %d messages in %.1fs -> %s'
+                      % (done, len(paths), path, messages, seconds, target), file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+# imports
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import aggregate
+import cache
+import corpus
+import jobs
+import preprocess
+import profiling
+import sentiment
+import store
+
+# Parse, score and aggregate a chat export.
+# workers is the number of processes scoring sentiment, None picks it from the number of
+# texts which are not in the score cache.
+# layout is one of preprocess.LAYOUTS, None detects it from the first lines.
+# backend is the name of a sentiment backend, None for sentiment.BACKEND.
+# progress is a jobs.Progress the stages are reported to, with the parsed frame.
+@profiling.profiled()
+def analyze(source, workers=None, layout=None, backend=None, progress=jobs.NO_PROGRESS):
+
+    # Perform preprocessing
+    progress.start('parse')
+    df = preprocess.preprocessor(source, layout=layout)
+
+    # Stats and timelines of the parsed messages can be shown while they are scored
+    progress.parsed(df)
+
+    # Scoring every distinct text once and filling (Positive/Negative/Neutral) columns and value
+    progress.start('sentiment')
+    df = sentiment.add_sentiment(df, workers=workers, backend=backend, progress=progress)
+
+    # Aggregates used by the timeline and activity functions
+    progress.start('aggregate')
+    aggregate.lookup(df)
+    return df
+
+
+# Analyzed chat of the uploaded bytes, computed once per distinct file content.
+# Looked up in memory first, then in the on-disk store. key is the content key when known.
+def load(data, key=None, progress=jobs.NO_PROGRESS):
+    if key is None:
+        with profiling.stage('pipeline.hash', 1):
+            key = cache.content_key(data)
+    return cache.results.get_or_compute(key, lambda: load_stored(key, data, progress=progress))
+
+
+# workers and progress are passed on to analyze
+@profiling.profiled()
+def load_stored(key, data, workers=None, progress=jobs.NO_PROGRESS):
+    progress.start('store')
+    df = store.load(key)
+    if df is not None:
+        aggregate.lookup(df)
+        return df
+
+    progress.start('extend')
+    df = extend(data)
+    if df is None:
+        df = analyze(data, workers, progress=progress)
+    progress.start('save')
+    try:
+        store.save(key, df, data=data)
+    except OSError:
+        # A read-only or full disk only costs the next restart a new analysis
+        pass
+    return df
+
+
+# Incremental analysis of an export which is a saved export plus new messages: only the
+# new tail is parsed and scored, then merged into the saved frame, corpus index and cube.
+# None if no saved export is a prefix of data.
+@profiling.profiled()
+def extend(data):
+    found = store.find_prefix(data)
+    if found is None:
+        return None
+    key, meta = found
+
+    # The saved frame was parsed with the layout of the saved export, which has to be
+    # the layout a full analysis of data would detect
+    layout = preprocess.detect_layout(data)
+    if preprocess.detect_layout(memoryview(data)[:meta['length']]) is not layout:
+        return None
+
+    # The tail has to start with a new message, not continue the last saved one
+    tail = bytes(memoryview(data)[meta['length']:]).decode('utf-8')
+    if not layout.regex.match(tail):
+        return None
+
+    old = cache.results.get(key)
+    if old is None:
+        old = store.load(key)
+    if old is None:
+        return None
+
+    new = analyze(tail, layout=layout)
+    if new.shape[0] and old.shape[0] and new['date'].min() < old['date'].max():
+        return None
+
+    return append(old, new)
+
+
+# Frame of old followed by new, with their corpus indexes and cubes merged
+def append(old, new):
+    if new.shape[0] == 0:
+        return old
+
+    new = new.copy()
+    start = old.index.max() + 1 if old.shape[0] else 0
+    new.index = new.index - new.index.min() + start
+    new[corpus.ID_COLUMN] += old.shape[0]
+
+    df = preprocess.concat_frames([old, new])
+    df.attrs = {
+        corpus.ATTR: corpus.merge(corpus.lookup(old)[0], corpus.lookup(new)[0]),
+        aggregate.ATTR: aggregate.merge(aggregate.lookup(old), aggregate.lookup(new)),
+    }
+    return df
+
+
+# Distinct display names of uploaded chats: the file name without .txt,
+# numbered when several files have the same name
+def chat_names(names):
+    result = []
+    for name in names:
+        stem = name[:-4] if name.lower().endswith('.txt') else name
+        unique = stem
+        n = 2
+        while unique in result:
+            unique = '%s (%d)' % (stem, n)
+            n += 1
+        result.append(unique)
+    return result
+
+
+# Frame of several analyzed chats put one after the other, with a categorical chat column.
+# The corpus indexes and cubes of the chats are merged, nothing is parsed or counted again.
+@profiling.profiled()
+def combine(names, frames):
+    parts = []
+    start = 0
+    for df in frames:
+        part = df.copy()
+        part[corpus.ID_COLUMN] += start
+        start += df.shape[0]
+        parts.append(part)
+
+    df = preprocess.concat_frames(parts)
+    df.index = pd.RangeIndex(df.shape[0])
+    codes = np.repeat(np.arange(len(names)), [frame.shape[0] for frame in frames])
+    df[aggregate.CHAT] = pd.Categorical.from_codes(codes, categories=names)
+    df.attrs = {
+        corpus.ATTR: corpus.merge(*[corpus.lookup(frame)[0] for frame in frames]),
+        aggregate.ATTR: aggregate.combine([aggregate.lookup(frame) for frame in frames], names),
+    }
+    return df
+
+
+# Whether the chats of the content keys are all in memory or in the store, so loading them
+# parses and scores nothing
+def ready(keys):
+    return all(key in cache.results or os.path.isdir(store.entry_path(key)) for key in keys)
+
+
+# Analyzed chats of several uploaded files, given as (file name, bytes) pairs, combined into
+# one frame. Chats which are neither in memory nor in the store are analyzed in parallel,
+# one process per chat. Files with the same content are analyzed once.
+# progress is a jobs.Progress counting the chats loaded.
+# keys are the content keys of the files when known, they are hashed otherwise.
+def load_chats(files, workers=None, progress=jobs.NO_PROGRESS, keys=None):
+    if keys is None:
+        with profiling.stage('pipeline.hash', len(files)):
+            keys = [cache.content_key(data) for _, data in files]
+    chats = {}
+    for key, (name, data) in zip(keys, files):
+        chats.setdefault(key, (name, data))
+
+    # Chats neither in memory nor in the store
+    new = [key for key in chats if not ready([key])]
+    progress.start('chats', len(chats))
+    if len(new) > 1:
+        with ProcessPoolExecutor(max_workers=workers or min(len(new), jobs.max_processes()),
+                                 mp_context=jobs.PROCESS_CONTEXT) as pool:
+            # Sentiment is scored in each chat's process, the chats are what runs in parallel
+            futures = {pool.submit(load_stored, key, chats[key][1], 1): key for key in new}
+            for future in as_completed(futures):
+                cache.results.put(futures[future], future.result())
+                progress.advance()
+
+    frames = []
+    for key, (_, data) in chats.items():
+        frames.append(load(data, key))
+        if key not in new or len(new) == 1:
+            progress.advance()
+
+    progress.start('combine')
+    names = chat_names([name for name, _ in chats.values()])
+    combined_key = ('chats',) + tuple(zip(chats, names))
+    return cache.results.get_or_compute(combined_key, lambda: combine(names, frames))
@@ -1,86 +1,302 @@
 # imports
+import io
+import itertools
+import os
 import re
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+import corpus
+import profiling
+
+# Time of a message: hours, minutes, optional seconds and the a/p of an optional am/pm
+# (12-hour clocks write it as "am", "AM", "a.m." ..., 24-hour clocks leave it out)
+TIME = r'(\d{1,2}):(\d{2})(?::(\d{2}))?(?:\s?([AaPp])\.?\s?[Mm]\.?)?'
+
+# number of lines read to find out the date layout of an export
+SAMPLE_LINES = 500
+
+
+# Date layout of an export: a regular expression matching the start of every message,
+# with the day, month and year captured in the order given by order (e.g. 'dmy'),
+# followed by the groups of TIME
+class Layout:
+
+    def __init__(self, name, order, pattern):
+        self.name = name
+        self.order = order
+        self.regex = re.compile(pattern)
+        self.fields = [order.index(field) for field in 'dmy']
+
+    # day, month and year of a match, None if it is not a valid date
+    def date_of(self, match):
+        day, month, year = (int(match.group(i + 1)) for i in self.fields)
+        if 1 <= day <= 31 and 1 <= month <= 12:
+            return day, month, year
+        return None
+
+    # datetime64 array of the capture groups of every match, without parsing date strings
+    def to_datetime(self, groups):
+        if not groups:
+            return np.array([], dtype='datetime64[us]')
+        columns = list(zip(*groups))
+        day, month, year = (integers(columns[i]) for i in self.fields)
+        hour, minute, second = integers(columns[3]), integers(columns[4]), integers(columns[5])
+
+        # two digit years are in this century
+        year = np.where(year < 100, year + 2000, year)
+
+        # 12-hour clock: 12 am is hour 0, 1 pm is hour 13
+        period = np.array([value or '' for value in columns[6]])
+        twelve_hour = period != ''
+        hour = np.where(twelve_hour, hour % 12 + np.isin(period, ('p', 'P')) * 12, hour)
+
+        months = (year - 1970).astype('datetime64[Y]') + (month - 1).astype('timedelta64[M]')
+        return (months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+                + hour.astype('timedelta64[h]') + minute.astype('timedelta64[m]')
+                + second.astype('timedelta64[s]')).astype('datetime64[us]')
+
+
+# Integer array of a column of capture groups, missing (optional) groups are 0
+def integers(column):
+    if None in column:
+        column = [value or '0' for value in column]
+    return np.array(column).astype(np.int64)
+
+
+# Android exports: "31/12/22, 9:41 pm - " (with a narrow no-break space before pm),
+# "31/12/2022, 21:41 - ", "12/31/22, 9:41 PM - ", "31.12.22, 21:41 - ", "2022-12-31, 21:41 - ".
+# iOS exports: "[31/12/22, 21:41:05] ", "[12/31/22, 9:41:05 PM] ", with an optional
+# left-to-right mark before the bracket.
+# When a sample fits several layouts equally well, the first one listed wins,
+# so day first is assumed for dates which can be read both ways.
+ANDROID_SLASH = r'(\d{1,2})/(\d{1,2})/(\d{2,4}),\s' + TIME + r'\s-\s'
+ANDROID_DOT = r'(\d{1,2})\.(\d{1,2})\.(\d{2,4}),?\s' + TIME + r'\s-\s'
+ANDROID_ISO = r'(\d{4})-(\d{1,2})-(\d{1,2}),?\s' + TIME + r'\s-\s'
+IOS = '\u200e?' + r'\[(\d{1,2})[/.](\d{1,2})[/.](\d{2,4}),?\s' + TIME + r'\]\s'
+
+LAYOUTS = [
+    Layout('android', 'dmy', ANDROID_SLASH),
+    Layout('android-us', 'mdy', ANDROID_SLASH),
+    Layout('android-dot', 'dmy', ANDROID_DOT),
+    Layout('android-iso', 'ymd', ANDROID_ISO),
+    Layout('ios', 'dmy', IOS),
+    Layout('ios-us', 'mdy', IOS),
+]
+LAYOUTS_BY_NAME = {layout.name: layout for layout in LAYOUTS}
+
+
+# Layout whose pattern gives valid dates for the most sample lines
+def pick_layout(lines):
+    best, best_count = LAYOUTS[0], 0
+    for layout in LAYOUTS:
+        count = 0
+        for line in lines:
+            match = layout.regex.match(line)
+            if match is not None and layout.date_of(match) is not None:
+                count += 1
+        if count > best_count:
+            best, best_count = layout, count
+    return best
+
+
+# Layout of an export, from its first SAMPLE_LINES lines
+def detect_layout(source):
+    return pick_layout(list(itertools.islice(iter_lines(source), SAMPLE_LINES)))
+
+# Labels of the categorical calendar columns, in calendar order
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+PERIODS = ['00-1'] + [str(hour) + "-" + str(hour + 1) for hour in range(1, 23)] + ['23-00']
+
+# Bumped whenever the data frame produced by the parser (or its corpus index) changes,
+# stored results of older versions are not reused
+PARSER_VERSION = 7
+
+# Messages are Arrow strings whatever pandas' default string type is, so their text stays in
+# Arrow buffers that corpus.split_words and the store's IPC files use as they are
+MESSAGE_DTYPE = pd.StringDtype('pyarrow')
+
+# number of messages in every data frame yielded by preprocess_chunks, the token lists of
+# this many messages are the most the parser holds at once
+CHUNK_SIZE = 20000
+
+
+# to read text lines from a string, path, bytes buffer or (text / binary) file object
+def iter_lines(source):
+    if isinstance(source, str):
+        yield from io.StringIO(source)
+    elif isinstance(source, os.PathLike):
+        with open(source, 'r', encoding='utf-8') as f:
+            yield from f
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield from io.TextIOWrapper(io.BytesIO(source), encoding='utf-8')
+    elif isinstance(source, io.TextIOBase):
+        yield from source
+    else:
+        # file received is a stream of byte data which is decoded while reading
+        text = io.TextIOWrapper(source, encoding='utf-8')
+        try:
+            yield from text
+        finally:
+            # leave the caller's file open
+            text.detach()
+
+
+# to read the export line by line and yield preprocessed data frames of chunk_size messages
+# layout is one of LAYOUTS, detected from the first lines when not given
+def preprocess_chunks(source, chunk_size=CHUNK_SIZE, layout=None):
+    lines = iter_lines(source)
+    if layout is None:
+        with profiling.stage('preprocess.detect_layout'):
+            sample = list(itertools.islice(lines, SAMPLE_LINES))
+            layout = pick_layout(sample)
+        lines = itertools.chain(sample, lines)
+    date_regex = layout.regex
+
+    dates = []
+    user_messages = []
+    current = None      # lines of the message being read
+    offset = 0          # index of the first message of the chunk
+
+    for line in lines:
+        match = date_regex.match(line)
+        if match is None:
+            # Lines without a date belong to the previous message (multi-line messages);
+            # anything before the first date is skipped
+            if current is not None:
+                current.append(line)
+            continue
+
+        if current is not None:
+            user_messages.append(''.join(current))
+            if len(user_messages) == chunk_size:
+                yield build_frame(dates, user_messages, offset, layout)
+                offset += len(user_messages)
+                dates = []
+                user_messages = []
+
+        dates.append(match.groups())
+        current = [line[match.end():]]
+
+    if current is not None:
+        user_messages.append(''.join(current))
+    if user_messages or offset == 0:
+        yield build_frame(dates, user_messages, offset, layout)
 
 
 # to convert text data into desired form
-def preprocessor(data):
-    # regular expression
-    pattern = r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s(?:am|pm)\s-\s'
+@profiling.profiled()
+def preprocessor(data, chunk_size=CHUNK_SIZE, layout=None):
+    chunks = []
+    indexes = []
+    for chunk in preprocess_chunks(data, chunk_size, layout):
+        # Tokens, emojis and links of every message, shared by helper functions. Indexed
+        # chunk by chunk, only the arrays of the index are kept.
+        indexes.append(corpus.CorpusIndex(chunk['message']))
+        chunks.append(chunk)
 
-    # Split text file into messages & dates based on pattern
-    messages = re.split(pattern, data)[1:]
-    dates = re.findall(pattern, data)
+    df = chunks[0] if len(chunks) == 1 else concat_frames(chunks)
+    del chunks
+    index = indexes[0] if len(indexes) == 1 else corpus.merge(*indexes)
+    del indexes
+    return corpus.attach(df, index)
 
-    # Creating data frame
-    df = pd.DataFrame({'user_message': messages, 'message_date': dates})
+
+# to build the data frame of one chunk of messages from the capture groups of their dates and text
+@profiling.profiled()
+def build_frame(dates, user_messages, offset=0, layout=LAYOUTS[0]):
 
     # convert dates type
-    df['message_date'] = pd.to_datetime(df['message_date'], format='%d/%m/%y, %I:%M\u202f%p - ')
-    df.rename(columns={'message_date': 'date'}, inplace=True)
-
-    users = []
-    messages = []
-    for message in df['user_message']:  # For each message in user_message
-
-        # Split message based on '([\w\W]+?):\s'
-        entry = re.split(r'([\w\W]+?):\s', message)
-        if entry[1:]:
-            # User name
-            users.append(entry[1])
-            # Only message
-            messages.append(" ".join(entry[2:]))
-        else:
-            # Adding group notifications
-            users.append('group_notification')
+    with profiling.stage('preprocess.dates', len(dates)):
+        message_dates = layout.to_datetime(dates)
 
-            # Null value
-            messages.append(entry[0])
+    # Creating data frame
+    df = pd.DataFrame({'user_message': pd.Series(user_messages, dtype=str), 'date': message_dates})
+    df.index = pd.RangeIndex(offset, offset + len(dates))
+
+    # Split message into user name and text on the first ':\s'
+    with profiling.stage('preprocess.user_split', len(dates)):
+        entry = df['user_message'].str.extract(r'^([\w\W]+?):\s([\w\W]*)$')
 
-    # Creating new columns
-    df['user'] = users
-    df['message'] = messages
+    # Messages without a user name are group notifications
+    df['user'] = entry[0].fillna('group_notification')
+    df['message'] = entry[1].fillna(df['user_message']).astype(MESSAGE_DTYPE)
 
     # Remove columns of no use
     df.drop(columns=['user_message'], inplace=True)
 
-    # Extract date
-    df['only_date'] = df['date'].dt.date
+    # Remove entries having user as group_notification
+    df = df[df['user'] != 'group_notification'].copy()
+
+    # Users are categories, in order of their first message
+    df['user'] = df['user'].astype(pd.CategoricalDtype(pd.unique(df['user'])))
+
+    # Calendar fields are small integers, the date of a message is df['date'].dt.date
+    # (daily timelines take it from the aggregate cube)
 
     # Extract year
-    df['year'] = df['date'].dt.year
+    df['year'] = df['date'].dt.year.astype(np.int16)
 
     # Extract month
-    df['month_num'] = df['date'].dt.month
+    df['month_num'] = df['date'].dt.month.astype(np.int8)
 
     # Extract month name
-    df['month'] = df['date'].dt.month_name()
+    df['month'] = pd.Categorical.from_codes(df['month_num'] - 1, categories=MONTHS)
 
     # Extract day
-    df['day'] = df['date'].dt.day
+    df['day'] = df['date'].dt.day.astype(np.int8)
 
     # Extract day name
-    df['day_name'] = df['date'].dt.day_name()
+    df['day_name'] = pd.Categorical.from_codes(df['date'].dt.dayofweek, categories=DAYS)
 
     # Extract hour
-    df['hour'] = df['date'].dt.hour
+    df['hour'] = df['date'].dt.hour.astype(np.int8)
 
     # Extract minute
-    df['minute'] = df['date'].dt.minute
-
-    # Remove entries having user as group_notification
-    df = df[df['user'] != 'group_notification']
+    df['minute'] = df['date'].dt.minute.astype(np.int8)
 
     # Creating a new column period form hour
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
-        else:
-            period.append(str(hour) + "-" + str(hour + 1))
-    df['period'] = period
+    df['period'] = pd.Categorical.from_codes(df['hour'], categories=PERIODS)
 
     # Returning preprocessed data frame
     return df
+
+
+# Frames of messages put one after the other, their user categories are combined
+# (new users are added after the known ones)
+def concat_frames(frames):
+    df = pd.concat(frames)
+    df['user'] = union_categoricals([frame['user'] for frame in frames])
+    return df
+
+
+# Memory taken by every column of a data frame, next to what the same data took with the
+# wide schema of earlier versions (object strings, int64 calendar fields and an only_date
+# column of date objects). The last row is the total.
+def memory_report(df):
+    frame = df.copy(deep=False)
+    frame.attrs = {}
+    wide = pd.DataFrame(index=frame.index)
+    for column in frame.columns:
+        values = frame[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values.dtype):
+            wide[column] = values.astype(object)
+        elif pd.api.types.is_integer_dtype(values.dtype) and column != 'value':
+            wide[column] = values.astype(np.int64)
+        else:
+            wide[column] = values
+    if 'date' in frame:
+        wide['only_date'] = frame['date'].dt.date
+
+    report = pd.DataFrame({
+        'dtype': frame.dtypes.astype(str),
+        'bytes': frame.memory_usage(index=False, deep=True),
+    }).reindex(wide.columns)
+    report['dtype'] = report['dtype'].fillna('-')
+    report['bytes'] = report['bytes'].fillna(0).astype(np.int64)
+    report['wide_bytes'] = wide.memory_usage(index=False, deep=True)
+    report.loc['total'] = ['', report['bytes'].sum(), report['wide_bytes'].sum()]
+    report['saved'] = 1 - report['bytes'] / report['wide_bytes'].where(report['wide_bytes'] > 0)
+    return report
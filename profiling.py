@@ -0,0 +1,203 @@
+# Timings of the pipeline stages, switched on with an environment variable:
+#
+#     CHAT_PROFILE=1 streamlit run app.py         wall time, peak RSS and row counts
+#     CHAT_PROFILE=memory streamlit run app.py    the same plus tracemalloc peak allocation
+#
+# Records are kept in memory (the latest MAX_RECORDS) for the whole process and can be
+# exported as a Chrome trace file (chrome://tracing or https://ui.perfetto.dev). The app tags
+# them with the chats they ran for and its sidebar shows those of the chats it has open; the
+# peak RSS of a record is the process's, whichever session ran it.
+# When profiling is off, stage() does nothing and profiled() returns the function unchanged.
+
+# imports
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+MODE = os.environ.get('CHAT_PROFILE', '').strip().lower()
+ENABLED = MODE not in ('', '0', 'false', 'no', 'off')
+TRACE_MEMORY = MODE == 'memory'
+
+MAX_RECORDS = 5000
+
+records = deque(maxlen=MAX_RECORDS)
+_lock = threading.Lock()
+_local = threading.local()
+
+if TRACE_MEMORY:
+    import tracemalloc
+    tracemalloc.start()
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+
+# Peak resident memory of the process so far, in MB
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+# Number of rows of a stage's result, when it has any
+def rows_of(value):
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    shape = getattr(value, 'shape', None)
+    if shape:
+        return int(shape[0])
+    return None
+
+
+# Tag of the stages run by this thread in the block, e.g. the chats a session shows, so
+# the records of one session can be told from the others of the same server
+class tagged:
+
+    def __init__(self, tag):
+        self.tag = tag
+
+    def __enter__(self):
+        self.outer = getattr(_local, 'tag', None)
+        _local.tag = self.tag
+        return self
+
+    def __exit__(self, *exc):
+        _local.tag = self.outer
+        return False
+
+
+class Stage:
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.alloc_peak = 0
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.depth = len(stack)
+        stack.append(self)
+        if TRACE_MEMORY:
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        _local.stack.pop()
+
+        record = {
+            'stage': self.name,
+            'depth': self.depth,
+            'started': self.started,
+            'seconds': seconds,
+            'rows': self.rows,
+            'peak_rss_mb': peak_rss_mb(),
+            'thread': threading.get_ident(),
+            'tag': getattr(_local, 'tag', None),
+            'failed': exc[0] is not None,
+        }
+        if TRACE_MEMORY:
+            # Nested stages reset the peak, so their peaks are carried up to the parent
+            self.alloc_peak = max(self.alloc_peak, tracemalloc.get_traced_memory()[1])
+            record['alloc_peak_mb'] = self.alloc_peak / 1024 / 1024
+            if _local.stack:
+                parent = _local.stack[-1]
+                parent.alloc_peak = max(parent.alloc_peak, self.alloc_peak)
+
+        with _lock:
+            records.append(record)
+        return False
+
+
+class _NoStage:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_stage = _NoStage()
+
+
+# Context manager timing a stage, set .rows on it to record a row count
+def stage(name, rows=None):
+    if not ENABLED:
+        return _no_stage
+    return Stage(name, rows)
+
+
+# Decorator timing every call of a function as a stage, rows are taken from the result
+def profiled(name=None):
+    def decorate(function):
+        if not ENABLED:
+            return function
+        stage_name = name or function.__module__ + '.' + function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Stage(stage_name) as current:
+                result = function(*args, **kwargs)
+                current.rows = rows_of(result)
+            return result
+        return wrapper
+    return decorate
+
+
+# Records of every thread, or only those tagged with tag
+def snapshot(tag=None):
+    with _lock:
+        if tag is None:
+            return list(records)
+        return [record for record in records if record['tag'] == tag]
+
+
+def clear(tag=None):
+    with _lock:
+        kept = [] if tag is None else [record for record in records if record['tag'] != tag]
+        records.clear()
+        records.extend(kept)
+
+
+# Records as a Chrome trace (list of complete events)
+def trace(recorded=None):
+    recorded = snapshot() if recorded is None else recorded
+    pid = os.getpid()
+    events = []
+    for record in recorded:
+        args = {key: value for key, value in record.items()
+                if key not in ('stage', 'started', 'seconds', 'thread', 'tag') and value is not None}
+        events.append({
+            'name': record['stage'],
+            'cat': record['stage'].split('.')[0],
+            'ph': 'X',
+            'ts': record['started'] * 1e6,
+            'dur': record['seconds'] * 1e6,
+            'pid': pid,
+            'tid': record['thread'],
+            'args': args,
+        })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def trace_json(recorded=None):
+    return json.dumps(trace(recorded))
+
+
+def export_trace(path, recorded=None):
+    with open(path, 'w') as f:
+        json.dump(trace(recorded), f)
+    return path
@@ -0,0 +1,156 @@
+# Reply latencies and conversation sessions, from the date and user columns of a chat.
+#
+# Messages are taken in date order (per chat, for frames of several chats). A message
+# whose sender differs from the sender of the message before it is a reply to that
+# sender; a silence longer than the session gap ends a conversation session, and messages
+# after such a gap are not counted as replies. Everything is computed with array
+# differences over the whole chat at once.
+
+# imports
+import numpy as np
+import pandas as pd
+import aggregate
+import profiling
+
+# Default silence, in minutes, after which a new conversation session starts
+SESSION_GAP = 60
+
+
+# Rows of a chat ('Overall' for all of them) in date order, exports usually are in order
+def ordered(df, chat_selected='Overall'):
+    if chat_selected != 'Overall':
+        df = df[df[aggregate.CHAT] == chat_selected]
+    dates = df['date'].to_numpy()
+    if aggregate.CHAT in df:
+        chats = df[aggregate.CHAT].cat.codes.to_numpy()
+    else:
+        chats = np.zeros(len(dates), dtype=np.int8)
+
+    step = np.diff(chats)
+    if np.all((step > 0) | ((step == 0) & (np.diff(dates) >= np.timedelta64(0)))):
+        return df
+    return df.iloc[np.lexsort((dates, chats))]
+
+
+# Users of the rows as category codes, and their categories
+def user_codes(df):
+    users = df['user']
+    if isinstance(users.dtype, pd.CategoricalDtype):
+        return users.cat.codes.to_numpy(), users.cat.categories
+    codes, categories = pd.factorize(users)
+    return codes, pd.Index(categories)
+
+
+# Seconds since the message before, and whether a message starts a new session
+def gaps(df, gap=SESSION_GAP):
+    seconds = np.diff(df['date'].to_numpy().astype('datetime64[s]').astype(np.int64))
+    new_session = np.ones(df.shape[0], dtype=bool)
+    new_session[1:] = seconds > gap * 60
+    if aggregate.CHAT in df:
+        new_session[1:] |= np.diff(df[aggregate.CHAT].cat.codes.to_numpy()) != 0
+    return seconds, new_session
+
+
+# Every reply: who replied (user), to whom (to), after how many seconds and when
+@profiling.profiled()
+def replies(df, gap=SESSION_GAP, chat_selected='Overall'):
+    df = ordered(df, chat_selected)
+    codes, users = user_codes(df)
+    seconds, new_session = gaps(df, gap)
+
+    # A reply is a change of sender within a session
+    index = np.flatnonzero((codes[1:] != codes[:-1]) & ~new_session[1:]) + 1
+    return pd.DataFrame({
+        'user': pd.Categorical.from_codes(codes[index], categories=users),
+        'to': pd.Categorical.from_codes(codes[index - 1], categories=users),
+        'seconds': seconds[index - 1],
+        'date': df['date'].to_numpy()[index],
+    })
+
+
+# Replies given or received by the selected user
+def user_replies(user_selected, df, gap=SESSION_GAP, chat_selected='Overall'):
+    pairs = replies(df, gap, chat_selected)
+    if user_selected != 'Overall':
+        pairs = pairs[(pairs['user'] == user_selected) | (pairs['to'] == user_selected)]
+    return pairs
+
+
+# Number of replies of every user (rows) to every other user (columns)
+@profiling.profiled()
+def reply_matrix(user_selected, df, gap=SESSION_GAP, chat_selected='Overall'):
+    pairs = user_replies(user_selected, df, gap, chat_selected)
+    return pd.crosstab(pairs['user'], pairs['to'])
+
+
+# Replies and median reply time in minutes of every (user, to) pair, most replies first
+@profiling.profiled()
+def pair_latency(user_selected, df, gap=SESSION_GAP, chat_selected='Overall'):
+    pairs = user_replies(user_selected, df, gap, chat_selected)
+    latency = pairs.groupby(['user', 'to'], observed=True)['seconds'].agg(['size', 'median'])
+    latency = latency.rename(columns={'size': 'replies', 'median': 'median_minutes'})
+    latency['median_minutes'] = (latency['median_minutes'] / 60).round(1)
+    return latency.sort_values('replies', ascending=False, kind='stable').reset_index()
+
+
+# Replies and median reply time in minutes of every user, fastest first
+@profiling.profiled()
+def user_latency(user_selected, df, gap=SESSION_GAP, chat_selected='Overall'):
+    pairs = replies(df, gap, chat_selected)
+    if user_selected != 'Overall':
+        pairs = pairs[pairs['user'] == user_selected]
+    latency = pairs.groupby('user', observed=True)['seconds'].agg(['size', 'median'])
+    latency = latency.rename(columns={'size': 'replies', 'median': 'median_minutes'})
+    latency['median_minutes'] = (latency['median_minutes'] / 60).round(1)
+    return latency.sort_values('median_minutes', kind='stable').reset_index()
+
+
+# Conversation sessions: start, end, length in minutes, messages, users taking part and the
+# user who started it. With a selected user, the sessions that user took part in.
+@profiling.profiled()
+def sessions(user_selected, df, gap=SESSION_GAP, chat_selected='Overall'):
+    df = ordered(df, chat_selected)
+    codes, users = user_codes(df)
+    _, new_session = gaps(df, gap)
+    dates = df['date'].to_numpy()
+
+    starts = np.flatnonzero(new_session)
+    ends = np.append(starts[1:], df.shape[0])[:len(starts)] - 1
+    session = np.cumsum(new_session) - 1
+
+    # Distinct (session, user) pairs give the users of every session
+    pairs = np.unique(session.astype(np.int64) * max(len(users), 1) + codes)
+    pair_sessions = pairs // max(len(users), 1)
+
+    result = pd.DataFrame({
+        'start': dates[starts],
+        'end': dates[ends],
+        'messages': ends - starts + 1,
+        'users': np.bincount(pair_sessions, minlength=len(starts)),
+        'starter': pd.Categorical.from_codes(codes[starts], categories=users),
+    })
+    result['minutes'] = ((result['end'] - result['start']).dt.total_seconds() / 60).round(1)
+    if aggregate.CHAT in df:
+        result.insert(0, aggregate.CHAT, df[aggregate.CHAT].to_numpy()[starts])
+
+    if user_selected != 'Overall':
+        code = users.get_loc(user_selected) if user_selected in users else -1
+        taking_part = np.zeros(len(starts), dtype=bool)
+        taking_part[pair_sessions[pairs % max(len(users), 1) == code]] = True
+        result = result[taking_part]
+    return result
+
+
+# Number of sessions, median session length and messages, and how many each user started
+@profiling.profiled()
+def session_summary(user_selected, df, gap=SESSION_GAP, chat_selected='Overall'):
+    found = sessions(user_selected, df, gap, chat_selected)
+    summary = {
+        'sessions': found.shape[0],
+        'median_minutes': float(found['minutes'].median()) if found.shape[0] else 0.0,
+        'median_messages': float(found['messages'].median()) if found.shape[0] else 0.0,
+    }
+    starters = found['starter'].value_counts()
+    starters = starters[starters > 0]
+    starters.index = starters.index.astype(str)
+    return summary, starters
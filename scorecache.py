@@ -0,0 +1,122 @@
+# On-disk cache of sentiment scores of distinct message texts, shared by every chat,
+# session and process. Group chats repeat the same short texts, so most messages of a
+# new chat are scored already.
+#
+# Scores are kept in an SQLite file keyed by a hash of the scorer name and the text, with
+# at most MAX_ENTRIES rows; the least recently used ones are removed first. A cache which
+# cannot be read or written only costs new scoring, never an error.
+
+# imports
+import contextlib
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+
+# Next to the chats of the store (store.STORE_DIR), which imports sentiment and so this module.
+# store.prune and store.py clear remove the file there with the chats.
+FILE_NAME = 'scores.sqlite'
+PATH = os.environ.get('CHAT_SCORES_PATH', os.path.join(
+    os.environ.get('CHAT_STORE_DIR',
+                   os.path.join(os.path.dirname(os.path.abspath(__file__)), '.chat_cache')),
+    FILE_NAME))
+MAX_ENTRIES = int(os.environ.get('CHAT_SCORES_MAX', '2000000'))
+
+# Rows read or written per statement
+BATCH = 50000
+
+
+# Key of a text scored by scorer
+def text_key(scorer, text):
+    return hashlib.blake2b((scorer + '\0' + text).encode('utf-8'), digest_size=16).digest()
+
+
+class ScoreCache:
+
+    def __init__(self, path=PATH, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+
+    # Connection in a transaction, committed and closed at the end of the with block
+    @contextlib.contextmanager
+    def connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('CREATE TABLE IF NOT EXISTS scores (key BLOB PRIMARY KEY, '
+                                   'pos REAL, neg REAL, neu REAL, used INTEGER)')
+                connection.execute('CREATE INDEX IF NOT EXISTS scores_used ON scores (used)')
+                yield connection
+        finally:
+            connection.close()
+
+    # Scores of the keys which are cached: (found mask, (n, 3) array, rows not found are 0)
+    def get(self, keys):
+        found = np.zeros(len(keys), dtype=bool)
+        scores = np.zeros((len(keys), 3), dtype=np.float64)
+        if not keys or self.max_entries <= 0:
+            return found, scores
+
+        try:
+            with self.connect() as connection:
+                connection.execute('CREATE TEMP TABLE wanted '
+                                   '(key BLOB PRIMARY KEY, position INTEGER)')
+                for start in range(0, len(keys), BATCH):
+                    connection.executemany('INSERT OR IGNORE INTO wanted VALUES (?, ?)',
+                                           zip(keys[start:start + BATCH], range(start, len(keys))))
+                rows = connection.execute('SELECT wanted.position, pos, neg, neu FROM wanted '
+                                          'JOIN scores ON scores.key = wanted.key').fetchall()
+
+                # Hits are recently used
+                connection.execute('UPDATE scores SET used = ? '
+                                   'WHERE key IN (SELECT key FROM wanted)', (int(time.time()),))
+                connection.execute('DROP TABLE wanted')
+        except (sqlite3.Error, OSError):
+            return found, scores
+
+        if rows:
+            rows = np.array(rows, dtype=np.float64)
+            positions = rows[:, 0].astype(np.int64)
+            found[positions] = True
+            scores[positions] = rows[:, 1:]
+        return found, scores
+
+    def put(self, keys, scores):
+        if not keys or self.max_entries <= 0:
+            return
+        now = int(time.time())
+        try:
+            with self.connect() as connection:
+                for start in range(0, len(keys), BATCH):
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)',
+                        ((key, float(pos), float(neg), float(neu), now) for key, (pos, neg, neu)
+                         in zip(keys[start:start + BATCH], scores[start:start + BATCH])))
+                self.prune(connection)
+        except (sqlite3.Error, OSError):
+            pass
+
+    # Remove the least recently used rows above max_entries
+    def prune(self, connection):
+        count = connection.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+        if count > self.max_entries:
+            connection.execute('DELETE FROM scores WHERE key IN '
+                               '(SELECT key FROM scores ORDER BY used LIMIT ?)',
+                               (count - self.max_entries,))
+
+    # Remove every score and give the space back to the file system
+    def clear(self):
+        try:
+            with self.connect() as connection:
+                connection.execute('DELETE FROM scores')
+            with self.connect() as connection:
+                connection.execute('VACUUM')
+        except (sqlite3.Error, OSError):
+            pass
+
+
+# Scores of the app, the batch CLI and every other caller which does not bring its own
+scores = ScoreCache()
@@ -0,0 +1,165 @@
+# Full-text search over the messages of an analyzed chat.
+#
+#     search.find(df, 'party "see you" tomor*', user_selected='Bob', k=1, start='2022-01-01')
+#
+# A query is a list of words, "quoted phrases" and prefixes ending in *, a message has to
+# match all of them. Words are matched case-insensitively and without the punctuation
+# around them. The inverted index is built from the corpus index's token stream on the
+# first search and kept with the data frame.
+
+# imports
+import numpy as np
+import pandas as pd
+import aggregate
+import corpus
+import profiling
+
+# Key of the search index in DataFrame.attrs
+ATTR = 'search'
+
+# Characters stripped from both ends of words
+PUNCTUATION = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~“”‘’«»…¿¡'
+
+
+# Word of a token or query as it is indexed
+def normalize(word):
+    return word.lower().strip(PUNCTUATION)
+
+
+# Words, phrases (lists of words) and prefixes of a query
+def parse(query):
+    words, phrases, prefixes = [], [], []
+    for i, part in enumerate(query.split('"')):
+        # Parts between quotes are phrases
+        if i % 2:
+            phrase = [normalize(word) for word in part.split()]
+            phrase = [word for word in phrase if word]
+            if len(phrase) == 1:
+                words.extend(phrase)
+            elif phrase:
+                phrases.append(phrase)
+            continue
+        for word in part.split():
+            if word.endswith('*') and normalize(word):
+                prefixes.append(normalize(word))
+            elif normalize(word):
+                words.append(normalize(word))
+    return words, phrases, prefixes
+
+
+# Inverted index of a corpus index: the token positions and message ids of every word,
+# grouped by word (sorted) and in message order within a word
+class SearchIndex:
+
+    def __init__(self, index):
+        self.corpus = index
+
+        # Vocabulary entries which only differ in punctuation share a term
+        words = np.array([normalize(word) for word in index.vocab], dtype=object)
+        term_of, terms = pd.factorize(words, sort=True)
+        self.terms = np.asarray(terms, dtype=object)
+        self.token_terms = term_of[index.tokens].astype(np.int32)
+
+        # Postings: token positions sorted by term, and the message of every position
+        self.positions = np.argsort(self.token_terms, kind='stable').astype(np.int32)
+        self.postings = index.token_owner[self.positions]
+        self.offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.token_terms, minlength=len(self.terms)), out=self.offsets[1:])
+
+    # The index is never modified, so copies of a data frame can share it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    # Code of a term, -1 if no message has it
+    def term(self, word):
+        code = np.searchsorted(self.terms, word)
+        if code < len(self.terms) and self.terms[code] == word:
+            return int(code)
+        return -1
+
+    # Sorted ids of the messages holding any of the terms from lo to hi (exclusive)
+    def messages(self, lo, hi):
+        return np.unique(self.postings[self.offsets[lo]:self.offsets[hi]])
+
+    def word(self, word):
+        code = self.term(word)
+        if code < 0:
+            return np.empty(0, dtype=np.int32)
+        return self.messages(code, code + 1)
+
+    def prefix(self, prefix):
+        lo = np.searchsorted(self.terms, prefix)
+        hi = np.searchsorted(self.terms, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        return self.messages(lo, hi)
+
+    # Messages holding the words one right after the other
+    def phrase(self, words):
+        codes = [self.term(word) for word in words]
+        if min(codes) < 0:
+            return np.empty(0, dtype=np.int32)
+
+        # Positions of the first word, kept while the next words follow in the same message
+        starts = self.positions[self.offsets[codes[0]]:self.offsets[codes[0] + 1]].astype(np.int64)
+        owner = self.corpus.token_owner
+        for i, code in enumerate(codes[1:], 1):
+            starts = starts[starts + i < len(self.token_terms)]
+            following = starts + i
+            starts = starts[(self.token_terms[following] == code) & (owner[following] == owner[starts])]
+        return np.unique(owner[starts])
+
+    # Sorted ids of the messages matching every part of a query, None for an empty query
+    def search(self, query):
+        words, phrases, prefixes = parse(query)
+        found = [self.word(word) for word in words]
+        found += [self.phrase(phrase) for phrase in phrases]
+        found += [self.prefix(prefix) for prefix in prefixes]
+        if not found:
+            return None
+
+        # Smallest first, so the intersections stay small
+        found.sort(key=len)
+        ids = found[0]
+        for other in found[1:]:
+            ids = np.intersect1d(ids, other, assume_unique=True)
+        return ids
+
+
+# Search index of a data frame, built on first use and kept with the frame
+def lookup(df):
+    index, ids = corpus.lookup(df)
+    search = df.attrs.get(ATTR)
+    if search is None or search.corpus is not index:
+        search = SearchIndex(index)
+        df.attrs[ATTR] = search
+    return search, ids
+
+
+# Messages of the selected user (and chat) matching the query, with sentiment k and dates
+# from start to end (inclusive days) when given, newest first
+@profiling.profiled()
+def find(df, query, user_selected='Overall', k=None, start=None, end=None, chat_selected='Overall',
+         limit=None):
+    search, ids = lookup(df)
+    mask = np.ones(df.shape[0], dtype=bool)
+
+    matched = search.search(query)
+    if matched is not None:
+        mask &= search.corpus.selection(matched)[ids]
+    if user_selected != 'Overall':
+        mask &= (df['user'] == user_selected).to_numpy()
+    if chat_selected != 'Overall':
+        mask &= (df[aggregate.CHAT] == chat_selected).to_numpy()
+    if k is not None and 'value' in df:
+        mask &= (df['value'] == k).to_numpy()
+    if start is not None:
+        mask &= (df['date'] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        mask &= (df['date'] < pd.Timestamp(end) + pd.Timedelta(days=1)).to_numpy()
+
+    columns = [column for column in ['date', aggregate.CHAT, 'user', 'message', 'value']
+               if column in df]
+    found = df.loc[mask, columns].sort_values('date', ascending=False, kind='stable')
+    return found if limit is None else found.head(limit)
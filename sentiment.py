@@ -0,0 +1,256 @@
+# Sentiment backends, picked by name with the CHAT_SENTIMENT environment variable:
+#
+#     vader      NLTK's VADER, message by message (default, the most accurate)
+#     lexicon    the VADER lexicon summed over the corpus index's token stream, without
+#                VADER's rules for negations, boosters, capitals and emojis; many times faster.
+#                Negated words keep their valence, "not good" scores positive.
+#
+# A backend scores the rows of a preprocessed data frame, see VaderBackend.score.
+
+# imports
+import os
+import string
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import corpus
+import jobs
+import profiling
+import scorecache
+
+# Order of the score columns, and the sentiment value each one stands for.
+# On ties the first column wins: positive, then negative, then neutral.
+SCORE_COLUMNS = ['po', 'ne', 'nu']
+SCORE_KEYS = ['pos', 'neg', 'neu']
+SCORE_VALUES = np.array([1, -1, 0], dtype=np.int8)
+
+# Name of the scorer in the score cache, changed when scores of the same text change
+SCORER = 'vader'
+
+# More distinct unseen texts than this are scored on all cores (with workers=None),
+# fewer are not worth starting a pool for
+PARALLEL_TEXTS = 50000
+
+# Folder looked in first for NLTK's VADER lexicon, and where it is downloaded to when no
+# NLTK data folder has it
+DATA_DIR = os.environ.get('CHAT_NLTK_DATA',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data'))
+LEXICON_RESOURCE = 'sentiment/vader_lexicon.zip'
+
+_resources_checked = False
+
+
+# Make sure the VADER lexicon can be found, once per process. Hosts which have it never
+# reach the network; without it, it is downloaded once or a LookupError says where to put it.
+def ensure_resources():
+    global _resources_checked
+    if _resources_checked:
+        return
+    import nltk
+    if DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, DATA_DIR)
+    try:
+        nltk.data.find(LEXICON_RESOURCE)
+    except LookupError:
+        if not nltk.download('vader_lexicon', download_dir=DATA_DIR, quiet=True):
+            raise LookupError('VADER lexicon not found, run nltk.download("vader_lexicon", '
+                              'download_dir=%r) on a host with network access' % DATA_DIR)
+    _resources_checked = True
+
+
+# One analyzer per process, created on first use
+_analyzer = None
+
+
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        ensure_resources()
+        # Importing SentimentIntensityAnalyzer class from "nltk.sentiment.vader"
+        from nltk.sentiment.vader import SentimentIntensityAnalyzer
+        _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+
+# Score a list of messages, calling polarity_scores once per message
+def score_chunk(messages):
+    analyzer = get_analyzer()
+    scores = np.empty((len(messages), len(SCORE_KEYS)), dtype=np.float64)
+    for i, message in enumerate(messages):
+        result = analyzer.polarity_scores(message)
+        scores[i] = [result[key] for key in SCORE_KEYS]
+    return scores
+
+
+# Texts as VADER reads them: it splits on whitespace, so leading, trailing and repeated
+# whitespace (the newline every message ends with) does not change a score
+def normalize(messages):
+    return pd.Series(messages, dtype=str).str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+# Scores of distinct texts, chunked and spread over workers processes. workers None uses
+# jobs.max_processes() processes when there are more than PARALLEL_TEXTS texts.
+# progress (a jobs.Progress) is advanced by the texts of every chunk scored.
+def score_texts(texts, chunk_size=10000, workers=1, progress=jobs.NO_PROGRESS):
+    if not texts:
+        return np.empty((0, len(SCORE_KEYS)), dtype=np.float64)
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+
+    if workers is None:
+        workers = jobs.max_processes() if len(texts) > PARALLEL_TEXTS else 1
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=jobs.PROCESS_CONTEXT) as pool:
+            results = []
+            for chunk, scores in zip(chunks, pool.map(score_chunk, chunks)):
+                results.append(scores)
+                progress.advance(len(chunk))
+    else:
+        results = []
+        for chunk in chunks:
+            results.append(score_chunk(chunk))
+            progress.advance(len(chunk))
+
+    return np.vstack(results)
+
+
+# Return an (n, 3) array of positive/negative/neutral scores for messages.
+# Every distinct text is scored once; texts found in score_cache (a scorecache.ScoreCache,
+# None for no on-disk cache) are not scored at all, new ones are added to it.
+# progress (a jobs.Progress) counts the texts scored.
+def score_messages(messages, chunk_size=10000, workers=1, score_cache=scorecache.scores,
+                   progress=jobs.NO_PROGRESS):
+    codes, texts = pd.factorize(normalize(messages))
+    texts = [str(text) for text in texts]
+    unique_scores = np.zeros((len(texts), len(SCORE_KEYS)), dtype=np.float64)
+
+    found = np.zeros(len(texts), dtype=bool)
+    if score_cache is not None:
+        with profiling.stage('sentiment.cache_get', len(texts)):
+            keys = [scorecache.text_key(SCORER, text) for text in texts]
+            found, unique_scores = score_cache.get(keys)
+
+    unseen = np.flatnonzero(~found)
+    progress.expect(len(unseen))
+    with profiling.stage('sentiment.score', len(unseen)):
+        unique_scores[unseen] = score_texts([texts[i] for i in unseen], chunk_size, workers,
+                                            progress)
+
+    if score_cache is not None and len(unseen):
+        with profiling.stage('sentiment.cache_put', len(unseen)):
+            score_cache.put([keys[i] for i in unseen], unique_scores[unseen])
+
+    return unique_scores[codes]
+
+
+# Sentiment value (1/-1/0) of every row, taken from the highest score column
+def sentiment_values(scores):
+    return SCORE_VALUES[np.argmax(scores, axis=1)]
+
+
+# Backends by name
+BACKENDS = {}
+
+# Backend used when none is given
+BACKEND = os.environ.get('CHAT_SENTIMENT', 'vader')
+
+
+def register(backend):
+    BACKENDS[backend.name] = backend()
+    return backend
+
+
+def get_backend(name=None):
+    name = name or BACKEND
+    if name not in BACKENDS:
+        raise ValueError('unknown sentiment backend %r, one of: %s' % (name, ', '.join(BACKENDS)))
+    return BACKENDS[name]
+
+
+@register
+class VaderBackend:
+    name = 'vader'
+
+    # (n, 3) array of positive/negative/neutral scores of the rows of df
+    def score(self, df, chunk_size=10000, workers=1, score_cache=scorecache.scores,
+              progress=jobs.NO_PROGRESS):
+        return score_messages(df['message'], chunk_size=chunk_size, workers=workers,
+                              score_cache=score_cache, progress=progress)
+
+
+# Word -> valence of the VADER lexicon, read once per process
+_lexicon = None
+
+# File of the lexicon, NLTK's vader_lexicon when not set
+LEXICON_PATH = os.environ.get('CHAT_LEXICON')
+
+
+# Lines of "word<TAB>valence<TAB>..." as a dictionary
+def read_lexicon(text):
+    lexicon = {}
+    for line in text.splitlines():
+        fields = line.split('\t')
+        if len(fields) >= 2:
+            lexicon[fields[0]] = float(fields[1])
+    return lexicon
+
+
+def get_lexicon():
+    global _lexicon
+    if _lexicon is None:
+        if LEXICON_PATH:
+            with open(LEXICON_PATH, encoding='utf-8') as f:
+                text = f.read()
+        else:
+            ensure_resources()
+            import nltk.data
+            path = nltk.data.find('sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt')
+            with path.open() as f:
+                text = f.read().decode('utf-8')
+        _lexicon = read_lexicon(text)
+    return _lexicon
+
+
+@register
+class LexiconBackend:
+    name = 'lexicon'
+
+    # Valence of every vocabulary word, looked up with and without surrounding punctuation
+    def valences(self, vocab):
+        lexicon = get_lexicon()
+        return np.fromiter((lexicon.get(word, lexicon.get(word.strip(string.punctuation), 0.0))
+                            for word in vocab), dtype=np.float64, count=len(vocab))
+
+    # Scores made the way VADER makes them from word valences: positive words add
+    # valence + 1, negative words valence - 1, other words count as neutral, and the three
+    # sums are divided by their total. Every word counts on its own, so negations do not
+    # flip the words after them ("not good" scores as "good"). chunk_size, workers and
+    # score_cache are not used.
+    def score(self, df, chunk_size=10000, workers=1, score_cache=None, progress=jobs.NO_PROGRESS):
+        index, ids = corpus.lookup(df)
+        valences = self.valences(index.vocab)[index.tokens]
+
+        # Sums per message over the token stream, tokens are grouped by message
+        positive = np.where(valences > 0, valences + 1, 0)
+        negative = np.where(valences < 0, 1 - valences, 0)
+        neutral = (valences == 0).astype(np.float64)
+        sums = np.column_stack([
+            np.bincount(index.token_owner, weights=weights, minlength=index.size)
+            for weights in (positive, negative, neutral)])[ids]
+
+        total = sums.sum(axis=1, keepdims=True)
+        return np.round(np.divide(sums, total, out=np.zeros_like(sums), where=total > 0), 3)
+
+
+# Adds po, ne, nu and value columns to the data frame, scored by the named backend
+@profiling.profiled()
+def add_sentiment(df, chunk_size=10000, workers=1, score_cache=scorecache.scores, backend=None,
+                  progress=jobs.NO_PROGRESS):
+    scores = get_backend(backend).score(df, chunk_size=chunk_size, workers=workers,
+                                        score_cache=score_cache, progress=progress)
+
+    df = df.copy()
+    for i, column in enumerate(SCORE_COLUMNS):
+        df[column] = scores[:, i]
+    df['value'] = sentiment_values(scores)
+    return df
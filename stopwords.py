@@ -0,0 +1,67 @@
+# imports
+import os
+import threading
+
+# Folder of this project, stop word files are looked up here by default
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Default stop word list (hinglish + english)
+DEFAULT_FILES = ('stop_hinglish.txt',)
+
+# path -> (modification time, frozenset of words)
+_file_cache = {}
+
+# tuple of (path, modification time) -> merged frozenset of words
+_merged_cache = {}
+
+_lock = threading.Lock()
+
+
+def resolve(path):
+    if os.path.isabs(path):
+        return path
+    return os.path.join(BASE_DIR, path)
+
+
+# Read one stop word file, one word per line
+def read_stop_words(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return frozenset(line.strip().lower() for line in f if line.strip())
+
+
+# Stop words of a single file, read again only when its modification time changes
+def load_file(path):
+    path = resolve(path)
+    mtime = os.path.getmtime(path)
+
+    cached = _file_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return mtime, cached[1]
+
+    words = read_stop_words(path)
+    _file_cache[path] = (mtime, words)
+    return mtime, words
+
+
+# Merged stop words of all given files (e.g. language packs) as a frozenset
+def get_stop_words(*paths):
+    paths = paths or DEFAULT_FILES
+
+    with _lock:
+        loaded = [(resolve(path),) + load_file(path) for path in paths]
+        key = tuple((path, mtime) for path, mtime, _ in loaded)
+
+        words = _merged_cache.get(key)
+        if words is None:
+            words = frozenset().union(*(words for _, _, words in loaded))
+            # only the latest version of a set of files is worth keeping
+            _merged_cache.clear()
+            _merged_cache[key] = words
+        return words
+
+
+# Forget every loaded file, the next call reads them again
+def clear_cache():
+    with _lock:
+        _file_cache.clear()
+        _merged_cache.clear()
@@ -0,0 +1,271 @@
+# On-disk cache of analyzed chats.
+# Every chat is a folder named after its content hash and the parser version, holding
+# the data frame as an Arrow IPC file and the corpus index as .npy / .arrow arrays, all
+# of which are memory-mapped when read back.
+
+# imports
+import argparse
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import cache
+import corpus
+import preprocess
+import profiling
+import scorecache
+import sentiment
+
+# Folder of the store and its size cap in MB
+STORE_DIR = os.environ.get('CHAT_STORE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '.chat_cache'))
+MAX_MB = int(os.environ.get('CHAT_STORE_MB', '2048'))
+
+FRAME_FILE = 'frame.arrow'
+META_FILE = 'meta.json'
+
+
+# Name suffix of the chats saved by this parser version and sentiment backend, results of
+# other versions and backends are never read
+def entry_suffix():
+    return '-p%d-%s' % (preprocess.PARSER_VERSION, sentiment.BACKEND)
+
+
+# Folder of a chat
+def entry_path(key, store_dir=None):
+    return os.path.join(store_dir or STORE_DIR, key + entry_suffix())
+
+
+def write_table(table, path):
+    with pa.OSFile(path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def read_table(path):
+    with pa.memory_map(path, 'r') as source:
+        return ipc.open_file(source).read_all()
+
+
+# Data frame of a saved table whose columns point into the memory-mapped file: to_pandas
+# already keeps the Arrow string column, numbers and dates are taken as read-only arrays
+# instead of the writable copies to_pandas makes
+def read_frame(path):
+    table = read_table(path)
+    mapped = {}
+    for name, column in zip(table.column_names, table.columns):
+        kind = column.type
+        if (name in table.schema.pandas_metadata.get('index_columns', []) or column.null_count
+                or column.num_chunks != 1):
+            continue
+        if pa.types.is_integer(kind) or pa.types.is_floating(kind) or (
+                pa.types.is_timestamp(kind) and kind.tz is None):
+            mapped[name] = column.chunk(0).to_numpy()
+
+    columns = table.column_names
+    df = table.drop_columns(list(mapped)).to_pandas(split_blocks=True, self_destruct=True)
+    data = {name: mapped[name] if name in mapped else df[name]
+            for name in columns if name in mapped or name in df}
+    return pd.DataFrame(data, index=df.index, copy=False)
+
+
+# Bytes at the beginning and at the end of an export compared before a whole prefix is hashed
+FINGERPRINT_BYTES = 64 * 1024
+
+
+# Hashes of the first and the last FINGERPRINT_BYTES of data[:length]. A saved export can
+# only be the beginning of data when both match, which costs two small hashes per saved chat.
+def fingerprint(data, length=None):
+    view = memoryview(data)
+    length = len(view) if length is None else length
+    head = view[:min(length, FINGERPRINT_BYTES)]
+    tail = view[max(0, length - FINGERPRINT_BYTES):length]
+    return [cache.content_key(head), cache.content_key(tail)]
+
+
+# Save an analyzed data frame (and its corpus index) under key.
+# data is the export it was made from, its length and fingerprint are kept to find it
+# again as the prefix of a longer export (see find_prefix).
+@profiling.profiled()
+def save(key, df, data=None, store_dir=None, max_mb=None):
+    path = entry_path(key, store_dir)
+    if os.path.isdir(path):
+        return path
+
+    # Written to a temporary folder first, so readers never see half written entries
+    tmp = '%s.tmp-%s' % (path, uuid.uuid4().hex)
+    os.makedirs(tmp)
+    try:
+        frame = df.copy(deep=False)
+        frame.attrs = {}
+        write_table(pa.Table.from_pandas(frame), os.path.join(tmp, FRAME_FILE))
+
+        index = df.attrs.get(corpus.ATTR)
+        if index is not None:
+            for name, array in index.to_arrays().items():
+                if array.dtype == object:
+                    write_table(pa.table({name: pa.array(array, type=pa.large_string())}),
+                                os.path.join(tmp, name + '.arrow'))
+                else:
+                    np.save(os.path.join(tmp, name + '.npy'), array)
+
+        meta = {'length': None if data is None else len(data),
+                'fingerprint': None if data is None else fingerprint(data),
+                'messages': df.shape[0],
+                'last_date': str(df['date'].max()) if df.shape[0] else None}
+        with open(os.path.join(tmp, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+        os.replace(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+
+    prune(max_mb, store_dir)
+    return path
+
+
+# Load a saved data frame, None if key was never saved
+@profiling.profiled()
+def load(key, store_dir=None):
+    path = entry_path(key, store_dir)
+    frame_file = os.path.join(path, FRAME_FILE)
+    if not os.path.isfile(frame_file):
+        return None
+
+    df = read_frame(frame_file)
+
+    arrays = {}
+    for name in corpus.CorpusIndex.ARRAYS:
+        if os.path.isfile(os.path.join(path, name + '.npy')):
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        elif os.path.isfile(os.path.join(path, name + '.arrow')):
+            column = read_table(os.path.join(path, name + '.arrow')).column(0)
+            arrays[name] = column.to_numpy(zero_copy_only=False).astype(object)
+    if len(arrays) == len(corpus.CorpusIndex.ARRAYS):
+        df.attrs[corpus.ATTR] = corpus.CorpusIndex(arrays=arrays)
+
+    # Last use time, prune removes the least recently used chats first
+    os.utime(path)
+    return df
+
+
+# Metadata saved with a chat, None if there is none
+def read_meta(path):
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Key and metadata of the longest saved chat whose export is the beginning of data,
+# None if there is none. Exports only ever grow at the end, so last week's export is the
+# prefix of this week's one.
+def find_prefix(data, store_dir=None):
+    store_dir = store_dir or STORE_DIR
+    suffix = entry_suffix()
+    if not os.path.isdir(store_dir):
+        return None
+
+    candidates = []
+    for name in os.listdir(store_dir):
+        if not name.endswith(suffix):
+            continue
+        meta = read_meta(os.path.join(store_dir, name))
+        if not meta or not meta.get('length') or meta['length'] >= len(data):
+            continue
+        # Beginning and end first, only chats matching both are hashed in full
+        if meta.get('fingerprint') == fingerprint(data, meta['length']):
+            candidates.append((meta['length'], name[:-len(suffix)], meta))
+
+    # Longest first, the hash of the prefix has to match the saved chat's key
+    for length, key, meta in sorted(candidates, reverse=True):
+        if cache.content_key(memoryview(data)[:length]) == key:
+            return key, meta
+    return None
+
+
+def folder_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+# Size of the score cache kept in the store folder (with its SQLite journal files)
+def scores_size(store_dir):
+    size = 0
+    for name in os.listdir(store_dir):
+        if name.startswith(scorecache.FILE_NAME):
+            size += os.path.getsize(os.path.join(store_dir, name))
+    return size
+
+
+# Remove least recently used chats until the store fits in max_mb, returns removed paths.
+# The score cache of the store folder counts towards max_mb and is emptied last, when the
+# store does not fit without it.
+def prune(max_mb=None, store_dir=None):
+    store_dir = store_dir or STORE_DIR
+    max_bytes = (MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    if not os.path.isdir(store_dir):
+        return []
+
+    entries = []
+    for name in os.listdir(store_dir):
+        path = os.path.join(store_dir, name)
+        if not os.path.isdir(path):
+            continue
+        # Leftovers of interrupted writes
+        if '.tmp-' in name:
+            if time.time() - os.path.getmtime(path) > 3600:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        entries.append((os.path.getmtime(path), folder_size(path), path))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries) + scores_size(store_dir)
+    removed = []
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed.append(path)
+
+    scores = os.path.join(store_dir, scorecache.FILE_NAME)
+    if total > max_bytes and os.path.isfile(scores):
+        scorecache.ScoreCache(scores).clear()
+        removed.append(scores)
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the on-disk cache of analyzed chats.')
+    parser.add_argument('command', choices=['prune', 'clear', 'info'])
+    parser.add_argument('--dir', default=STORE_DIR, help='store folder (default: %(default)s)')
+    parser.add_argument('--max-mb', type=int, default=MAX_MB,
+                        help='size cap used by prune (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.command in ('prune', 'clear'):
+        removed = prune(args.max_mb if args.command == 'prune' else 0, args.dir)
+        chats = [path for path in removed if os.path.basename(path) != scorecache.FILE_NAME]
+        print('removed %d chat(s)%s' % (len(chats), ' and the score cache'
+                                          if len(chats) < len(removed) else ''))
+    else:
+        size = folder_size(args.dir) if os.path.isdir(args.dir) else 0
+        names = os.listdir(args.dir) if os.path.isdir(args.dir) else []
+        count = sum(os.path.isdir(os.path.join(args.dir, name)) for name in names)
+        print('%s: %d chat(s), %.1f MB' % (args.dir, count, size / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()